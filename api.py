@@ -1,20 +1,287 @@
-import datetime
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import email.utils
+import functools
+import gzip
+import hashlib
+import heapq
 import json
 import math
+import metrics
+import multiprocessing
+import os
+import queue
 import re
 import requests
+import store
+import tempfile
 import time
 import threading
+import urllib.parse
+import uuid
 from bs4 import BeautifulSoup
-from flask import Flask, request, logging, abort, Response
+from flask import Flask, request, logging, abort, Response, stream_with_context
 import werkzeug.exceptions
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 app = Flask(__name__)
 logger = logging.create_logger(app)
 logger.root.setLevel('INFO')
 
-# (for the sake of an example) local kv-storage for asynk tasks
-JOBS = {}
+# metrics exposed at /metrics
+METRICS = metrics.Registry()
+HTTP_REQUESTS = METRICS.counter('screview_http_requests_total', 'Requests sent to the remote, by status code (or error)', labels=('status',))
+DOWNLOADED_BYTES = METRICS.counter('screview_downloaded_bytes_total', 'Bytes of (decompressed) response bodies received from the remote')
+RATE_LIMIT_WAIT = METRICS.counter('screview_rate_limit_wait_seconds_total', 'Seconds the remote asked us to wait in 429 responses')
+THROTTLE_WAIT = METRICS.counter('screview_throttle_wait_seconds_total', 'Seconds requests were held back by per-host rate limiters')
+STAGE_SECONDS = METRICS.histogram('screview_stage_seconds', 'Time spent per page in each processing stage', labels=('stage',))
+JOB_PAGES = METRICS.histogram('screview_job_pages', 'Pages processed per get_reviews() call', buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+JOB_REVIEWS = METRICS.histogram('screview_job_reviews', 'Reviews returned per get_reviews() call', buckets=(0, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000))
+
+# storage for asynk tasks: path to SQLite database shared by all processes on this host ('memory' to keep jobs in this process only),
+# number of seconds a job is kept after its last update, maximum number of jobs kept
+JOB_STORE = os.environ.get('SCREVIEW_JOB_STORE', os.path.join(tempfile.gettempdir(), 'screview_jobs.sqlite3'))
+JOB_TTL = int(os.environ.get('SCREVIEW_JOB_TTL', store.DEFAULT_TTL))
+JOB_STORE_MAX_JOBS = int(os.environ.get('SCREVIEW_JOB_STORE_MAX_JOBS', store.DEFAULT_MAX_JOBS))
+JOBS = store.open_job_store(JOB_STORE, ttl=JOB_TTL, max_jobs=JOB_STORE_MAX_JOBS)
+
+# state of listings crawled incrementally (by base URL), kept next to the jobs
+LISTINGS = store.open_listing_store(JOB_STORE)
+
+# hashes of reviews seen by any job (by review URL), kept next to the jobs, up to this many reviews
+REVIEW_INDEX_MAX_REVIEWS = int(os.environ.get('SCREVIEW_REVIEW_INDEX_MAX_REVIEWS', store.DEFAULT_MAX_INDEXED_REVIEWS))
+REVIEWS = store.open_review_index(JOB_STORE, max_reviews=REVIEW_INDEX_MAX_REVIEWS)
+
+# crawl engine: 'threads' (requests, one thread per page in flight) or 'asyncio' (aiohttp, all pages on one event loop; requires aiohttp)
+CRAWL_ENGINE = os.environ.get('SCREVIEW_CRAWL_ENGINE', 'threads')
+
+# background jobs: number of worker threads running them, number of jobs allowed to wait in the queue
+JOB_WORKERS = 4
+JOB_QUEUE_SIZE = 100
+# with the asyncio engine, background jobs run as coroutines on the event loop instead of worker threads:
+# number of jobs running at the same time, seconds between checks of a batch budget held by other jobs
+ASYNC_JOBS = int(os.environ.get('SCREVIEW_ASYNC_JOBS', 64))
+BUDGET_POLL_INTERVAL = 0.05
+
+# statuses of jobs that have not finished yet
+PENDING_JOB_STATUSES = ('Requested', 'In progress')
+
+# results of a job: default and maximum number of reviews per page, seconds between checks for new reviews while streaming a running job
+RESULT_PAGE_SIZE = 100
+RESULT_PAGE_SIZE_MAX = 1000
+RESULT_STREAM_POLL_INTERVAL = 0.5
+
+# results of a job: number of serialized results of finished jobs kept, bodies smaller than this many bytes are sent uncompressed
+RESULT_CACHE_SIZE = 64
+RESULT_COMPRESS_MIN_SIZE = 1024
+
+# progress of a job: default and maximum number of seconds a client waits for it to change
+PROGRESS_WAIT = 30
+PROGRESS_WAIT_MAX = 60
+
+# upper bound for number of pages requested at the same time by a single crawl job
+MAX_CRAWL_CONCURRENCY = 16
+
+# number of reviews the remote shows per page
+REVIEWS_PER_PAGE = 25
+
+# connection pool settings: number of hosts to keep pools for, connections kept alive per host, (connect, read) timeouts in seconds
+HTTP_POOL_HOSTS = 4
+HTTP_POOL_SIZE = 32
+HTTP_TIMEOUT = (5, 30)
+
+
+def create_session(pool_hosts=HTTP_POOL_HOSTS, pool_size=HTTP_POOL_SIZE):
+    """Create HTTP session that keeps connections alive and reuses them across threads.
+
+    Args:
+        int pool_hosts: number of hosts to keep connection pools for
+        int pool_size: maximum number of connections kept alive per host
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': requests.utils.DEFAULT_ACCEPT_ENCODING, 'Connection': 'keep-alive'})
+    return session
+
+
+# shared session, every request to the remote goes through its connection pool
+SESSION = create_session()
+
+
+def connection_stats(session=None):
+    """Return counters showing how often pooled connections were reused versus newly opened.
+
+    Args:
+        requests.Session session: session to inspect (shared session if not specified)
+    """
+    session = session or SESSION
+    stats = {'requests': 0, 'connections_opened': 0, 'connections_reused': 0}
+    for adapter in set(session.adapters.values()):
+        for key in adapter.poolmanager.pools.keys():
+            pool = adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            stats['requests'] += pool.num_requests
+            stats['connections_opened'] += pool.num_connections
+    stats['connections_reused'] = max(0, stats['requests'] - stats['connections_opened'])
+    return stats
+
+
+# number of worker processes parsing pages, so parsing of bulk crawls scales with cores (0 to parse in the requesting thread)
+PARSE_WORKERS = int(os.environ.get('SCREVIEW_PARSE_WORKERS', 0))
+
+
+def create_parse_pool(workers):
+    """Create process pool for parsing pages. Worker processes are forked right away,
+    before this process starts any threads, so they don't inherit locks held by other threads.
+
+    Args:
+        int workers: number of worker processes
+    """
+    pool = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+    pool.submit(int).result()
+    return pool
+
+
+PARSE_POOL_LOCK = threading.Lock()
+
+
+def drop_parse_pool(pool):
+    """Stop handing pages to a parse pool that broke because a worker process died, so pages are parsed in requesting threads from now on.
+    The pool is not rebuilt: forking new workers once this process runs threads could leave them with copies of locks held by those threads.
+
+    Args:
+        object pool: broken pool
+    """
+    global PARSE_POOL
+    with PARSE_POOL_LOCK:
+        if PARSE_POOL is pool:
+            logger.error('Parse pool is broken (a worker process died), parsing pages in requesting threads until restart')
+            PARSE_POOL = None
+            pool.shutdown(wait=False)
+
+
+# cache of parsed pages: maximum number of pages kept, number of seconds a page is served without revalidation
+PAGE_CACHE_SIZE = 512
+PAGE_CACHE_TTL = 300
+
+# per-host rate limit: sustained requests per second, burst size, lowest rate to back off to on 429
+RATE_LIMIT_PER_SECOND = 4.0
+RATE_LIMIT_BURST = 8
+RATE_LIMIT_MIN_PER_SECOND = 0.25
+# seconds to pause when 429 comes without usable Retry-After header, and number of times a page is rescheduled after 429
+DEFAULT_RETRY_AFTER = 5
+RATE_LIMIT_MAX_RETRIES = 3
+
+
+class TokenBucket:
+    """Thread-safe token bucket pacing requests sent to a single host.
+
+    Callers reserve a token and get back the delay after which they may send the request,
+    so the bucket never holds a thread while waiting.
+    """
+
+    def __init__(self, rate=RATE_LIMIT_PER_SECOND, burst=RATE_LIMIT_BURST, min_rate=RATE_LIMIT_MIN_PER_SECOND):
+        """
+        Args:
+            float rate: sustained number of requests per second
+            int burst: number of requests that can be sent at once after the host was idle
+            float min_rate: lowest rate the bucket will back off to when the remote reports rate limit
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def reserve(self):
+        """Take a token and return number of seconds to wait before sending the request"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            delay = max(0.0, self.updated - now)
+            if self.tokens < 0:
+                delay += -self.tokens / self.rate
+            return delay
+
+    def backoff(self, retry_after):
+        """Pause the host for specified number of seconds and halve the request rate.
+
+        Args:
+            float retry_after: number of seconds the remote asked us to wait
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now + retry_after > self.updated:
+                # reservations handed out before the pause are void, their callers will be turned down and reserve again
+                self.updated = now + retry_after
+                self.tokens = 1.0
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def recover(self):
+        """Raise the request rate back towards its maximum after a successful request"""
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+# rate limiters shared by all jobs, by host name
+HOST_LIMITERS = {}
+HOST_LIMITERS_LOCK = threading.Lock()
+
+
+def rate_limiter(url):
+    """Return rate limiter shared by every request sent to the host of specified URL.
+
+    Args:
+        str url: URL to send request to
+    """
+    host = urllib.parse.urlsplit(url).netloc.lower()
+    with HOST_LIMITERS_LOCK:
+        if host not in HOST_LIMITERS:
+            HOST_LIMITERS[host] = TokenBucket()
+        return HOST_LIMITERS[host]
+
+
+def parse_retry_after(value):
+    """Convert value of Retry-After header (either seconds or HTTP date) to number of seconds.
+
+    Args:
+        str value: header value
+    """
+    if value is None:
+        return DEFAULT_RETRY_AFTER
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+    return max(0, math.ceil(retry_at.timestamp() - time.time()))
 
 
 def try_challenge(initial_response):
@@ -24,47 +291,60 @@ def try_challenge(initial_response):
     return False, 'Completed, status code %s' % (initial_response.status_code), None
 
 
-def try_get_request(url, retry_on_rate_limit=True):
-    """Send GET request.
+def try_get_request(url, retry_on_rate_limit=True, headers=None):
+    """Send GET request right away. Pacing requests by the host's rate limiter and retrying after rate limit
+    is left to the caller (see fetch_pages()), so no thread sleeps here.
     
     Args:
         str url: URL to send request to
-        bool retry_on_rate_limit: when True, if rate limit is encountered on the remote, we will wait and retry
+        bool retry_on_rate_limit: when True, the caller is going to retry if rate limit is encountered on the remote (only logged here)
+        dict headers: additional request headers (e.g. validators for conditional request)
     """
+    limiter = rate_limiter(url)
     logger.info('Requesting %s' % (url))
     try:
-        response = requests.get(url)
+        with STAGE_SECONDS.time(stage='fetch'):
+            response = SESSION.get(url, headers=headers, timeout=HTTP_TIMEOUT)
     except requests.exceptions.MissingSchema:
+        HTTP_REQUESTS.inc(status='error')
         return False, 'Failed, invalid URL', None
     except requests.exceptions.ConnectionError:
+        HTTP_REQUESTS.inc(status='error')
         return False, 'Failed, connection error', None
+    except requests.exceptions.Timeout:
+        HTTP_REQUESTS.inc(status='error')
+        return False, 'Failed, timeout', None
+    HTTP_REQUESTS.inc(status=str(response.status_code))
+    DOWNLOADED_BYTES.inc(len(response.content or b''))
     logger.info('Got response, status code %d' % (response.status_code))
-    if response.status_code == 200:
+    if response.status_code in (200, 304): # 304 if page has not changed since the version in conditional request
+        limiter.recover()
         return True, 'Completed, status code %s' % (response.status_code), response
     elif response.status_code == 503: # challenge?
         return try_challenge(response)
     elif response.status_code == 429: # rate limit?
-        retry_after = int(response.headers['retry-after'])
+        retry_after = parse_retry_after(response.headers.get('retry-after'))
         logger.warning('Rate limit allows retrying in %d seconds' % (retry_after))
+        RATE_LIMIT_WAIT.inc(retry_after)
+        limiter.backoff(retry_after)
         if retry_on_rate_limit:
-            logger.info('Retrying in %d s' % (retry_after))
-            time.sleep(retry_after)
-            return try_get_request(url, retry_on_rate_limit=False)
-        logger.warning('Will not retry, moving on')
+            logger.info('Leaving retry to the caller')
+        else:
+            logger.warning('Will not retry, moving on')
     return False, 'Completed, status code %s' % (response.status_code), None
 
 
-def get_rating_distribution(soup):
-    """Locate and parse specific section of a page containg review rating distribution.
+# fast path: scripts carrying the payloads we need, located without building the whole document tree
+HELMET_SCRIPT_RE = re.compile(r'<script\b[^>]*\bdata-react-helmet="true"[^>]*>(.*?)</script>', re.S)
+SSR_DATA_SCRIPT_RE = re.compile(r'<script\b[^>]*>(window\.__ssr_data.*?)</script>', re.S)
+
+
+def decode_rating_distribution(script_text):
+    """Extract review rating distribution from text of a script assigning window.__ssr_data.
 
     Args:
-        BeautifulSoup soup: object representing parsed HTML page
+        str script_text: text of the script
     """
-    script_child = soup.find(string=re.compile(r'^window.__ssr_data'))
-    if script_child is None:
-        logger.warning('Could not find section to extract ratingDistribution from')
-        return []
-    script_text = str(script_child)
     ssr_data_statement = script_text[script_text.find("window.__ssr_data='"):script_text.find("}';", script_text.find("window.__ssr_data='"))+2]
     ssr_data = ssr_data_statement[19:-1].replace('\\\\n', '\n').replace('\\\\', '$backslash').replace('\\', '').replace('$backslash', '\\')
     try:
@@ -77,6 +357,41 @@ def get_rating_distribution(soup):
     return rating_distribution
 
 
+def get_rating_distribution(soup):
+    """Locate and parse specific section of a page containg review rating distribution.
+
+    Args:
+        BeautifulSoup soup: object representing parsed HTML page
+    """
+    script_child = soup.find(string=re.compile(r'^window.__ssr_data'))
+    if script_child is None:
+        logger.warning('Could not find section to extract ratingDistribution from')
+        return []
+    return decode_rating_distribution(str(script_child))
+
+
+def extract_scripts(html, get_ssr_data):
+    """Locate text of the script with review data (JSON-LD) and, optionally, of the script assigning window.__ssr_data.
+    Scans raw HTML for both scripts and only parses the whole page with BeautifulSoup when the layout doesn't match.
+    Returns tuple (content_text, ssr_text) where either item is None if the script is not found.
+
+    Args:
+        str html: text to scan (expecting HTML page with reviews)
+        bool get_ssr_data: when True, script containing review rating distribution will be located as well
+    """
+    with STAGE_SECONDS.time(stage='scan'):
+        content_match = HELMET_SCRIPT_RE.search(html)
+        ssr_match = SSR_DATA_SCRIPT_RE.search(html) if get_ssr_data else None
+    if content_match is not None and (ssr_match is not None or not get_ssr_data):
+        return content_match.group(1), ssr_match.group(1) if ssr_match is not None else None
+    logger.info('Page layout does not match the fast path, parsing the whole page')
+    with STAGE_SECONDS.time(stage='soup_parse'):
+        soup = BeautifulSoup(html, 'html.parser')
+        content_element = soup.find(name='script', attrs={'data-react-helmet': 'true'})
+        ssr_child = soup.find(string=re.compile(r'^window.__ssr_data')) if get_ssr_data else None
+    return content_element.text if content_element is not None else None, str(ssr_child) if ssr_child is not None else None
+
+
 def parse_html(html, get_ssr_data, url, response_description):
     """Parse HTML content (supposedly returned as some response.text)
 
@@ -87,18 +402,22 @@ def parse_html(html, get_ssr_data, url, response_description):
         str response_description: message from helper function that was sending HTTP request
     """
     total_reviews, rating_distribution, reviews = 0, [], {}
-    soup = BeautifulSoup(html, 'html.parser')
-    content_element = soup.find(name='script', attrs={'data-react-helmet': 'true'})
+    content_text, ssr_text = extract_scripts(html, get_ssr_data)
     
-    if content_element is None: # page is likely invalid
+    if content_text is None: # page is likely invalid
         msg = 'Page is invalid: %s' % (url)
         logger.warning(msg)
         return response_description, msg, total_reviews, rating_distribution, reviews
     
     if get_ssr_data:
-        rating_distribution = get_rating_distribution(soup)
+        if ssr_text is None:
+            logger.warning('Could not find section to extract ratingDistribution from')
+        else:
+            with STAGE_SECONDS.time(stage='ssr_extract'):
+                rating_distribution = decode_rating_distribution(ssr_text)
     
-    content = json.loads(content_element.text)
+    with STAGE_SECONDS.time(stage='content_extract'):
+        content = json.loads(content_text)
     if 'aggregateRating' not in content: # page is likely invalid
         msg = 'Page is invalid: %s' % (url)
         logger.warning(msg)
@@ -113,20 +432,206 @@ def parse_html(html, get_ssr_data, url, response_description):
     return response_description, msg, total_reviews, rating_distribution, reviews
 
 
-def get_reviews_from_page(url, retry_on_rate_limit, get_ssr_data=False):
+class PageCache:
+    """LRU cache of parsed pages by URL, along with the validators (ETag, Last-Modified) needed to revalidate them"""
+
+    def __init__(self, size=PAGE_CACHE_SIZE, ttl=PAGE_CACHE_TTL):
+        """
+        Args:
+            int size: maximum number of pages kept
+            int ttl: number of seconds a page is served without asking the remote whether it has changed
+        """
+        self.size = size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.hits, self.revalidations, self.misses = 0, 0, 0
+        self.lock = threading.Lock()
+
+    def get(self, url, get_ssr_data):
+        """Return cached entry for the page as dict with keys 'fetched', 'etag', 'last_modified', 'result', or None if there is no usable entry.
+
+        Args:
+            str url: URL of the page
+            bool get_ssr_data: when True, only entries that include review rating distribution are usable
+        """
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None or (get_ssr_data and not entry['get_ssr_data']):
+                return None
+            self.entries.move_to_end(url)
+            return entry
+
+    def put(self, url, get_ssr_data, response, result):
+        """Store parsed page along with validators from the response.
+
+        Args:
+            str url: URL of the page
+            bool get_ssr_data: True if result includes review rating distribution
+            object response: response the page was parsed from (requests or aiohttp, only its headers are used)
+            tuple result: value returned by parse_html()
+        """
+        entry = {'fetched': time.monotonic(), 'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified'), 'get_ssr_data': get_ssr_data, 'result': result}
+        with self.lock:
+            self.entries[url] = entry
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def record(self, outcome):
+        """Count lookup outcome: 'hit' (served from cache), 'revalidation' (served from cache after 304) or 'miss'"""
+        with self.lock:
+            if outcome == 'hit':
+                self.hits += 1
+            elif outcome == 'revalidation':
+                self.revalidations += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        """Return cache size and lookup counters"""
+        with self.lock:
+            return {'pages': len(self.entries), 'hits': self.hits, 'revalidations': self.revalidations, 'misses': self.misses}
+
+
+# parsed pages shared by all jobs
+PAGE_CACHE = PageCache()
+
+
+def cached_result(entry, get_ssr_data):
+    """Return copy of parsed page kept in cache entry, so callers can update it freely.
+
+    Args:
+        dict entry: cache entry
+        bool get_ssr_data: when False, review rating distribution is left out as if it had not been parsed
+    """
+    response_description, msg, total_reviews, rating_distribution, reviews = entry['result']
+    return response_description, msg, total_reviews, list(rating_distribution) if get_ssr_data else [], dict(reviews)
+
+
+def lookup_page(url, get_ssr_data):
+    """Look up page in cache. Returns tuple (result, entry, headers): result is set if cached page can be served right away,
+    otherwise entry is the cache entry to revalidate (if any) and headers hold its validators for conditional request.
+
+    Args:
+        str url: URL of the page
+        bool get_ssr_data: when True, review rating distribution is needed as well
+    """
+    entry = PAGE_CACHE.get(url, get_ssr_data)
+    headers = {}
+    if entry is not None:
+        if time.monotonic() - entry['fetched'] < PAGE_CACHE.ttl:
+            logger.info('Page %s is cached' % (url))
+            PAGE_CACHE.record('hit')
+            return cached_result(entry, get_ssr_data), entry, None
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+    return None, entry, headers or None
+
+
+def parse_body(body, encoding, get_ssr_data, url, response_description):
+    """Decode raw response body and parse it. Runs in a parse pool worker when the pool is enabled,
+    so only the raw bytes are sent to the worker and only the extracted review records come back.
+
+    Args:
+        bytes body: raw response body
+        str encoding: encoding of the body
+        bool get_ssr_data: when True, specific part of the page containing review rating distribution will be parsed as well
+        str url: URL of the page
+        str response_description: message from helper function that was sending HTTP request
+    """
+    with STAGE_SECONDS.time(stage='decode'):
+        html = str(body or b'', encoding or 'utf8', errors='replace')
+    return parse_html(html, get_ssr_data, url, response_description)
+
+
+def parse_body_in_worker(*args):
+    """Run parse_body() in a worker of the parse pool, returning its result along with the stage timings observed in the worker,
+    as metrics of worker processes are not exposed.
+
+    Args:
+        tuple args: arguments of parse_body()
+    """
+    with STAGE_SECONDS.recording() as timings:
+        result = parse_body(*args)
+    return result, timings
+
+
+def parse_page(url, get_ssr_data, entry, response_description, status_code, response, body, encoding):
+    """Parse downloaded page, or take it from cache entry if the remote says it has not changed, and keep the result in cache.
+
+    Args:
+        str url: URL of the page
+        bool get_ssr_data: when True, specific part of the page containing review rating distribution will be parsed as well
+        dict entry: cache entry the request was conditional on (None if request was not conditional)
+        str response_description: message from helper function that was sending HTTP request
+        int status_code: HTTP status code of the response
+        object response: response (its headers are kept for revalidation)
+        bytes body: raw response body
+        str encoding: encoding of the body
+    """
+    if status_code == 304 and entry is not None:
+        logger.info('Page %s has not changed since cached' % (url))
+        PAGE_CACHE.record('revalidation')
+        entry['fetched'] = time.monotonic()
+        return cached_result(entry, get_ssr_data)
+    PAGE_CACHE.record('miss')
+    pool = PARSE_POOL
+    result = None
+    if pool is not None:
+        try:
+            with STAGE_SECONDS.time(stage='parse_pool'):
+                result, timings = pool.submit(parse_body_in_worker, body, encoding, get_ssr_data, url, response_description).result()
+        except concurrent.futures.process.BrokenProcessPool:
+            drop_parse_pool(pool)
+        else:
+            for labels, seconds in timings:
+                STAGE_SECONDS.observe(seconds, **labels)
+    if result is None:
+        result = parse_body(body, encoding, get_ssr_data, url, response_description)
+    if status_code == 200:
+        PAGE_CACHE.put(url, get_ssr_data, response, result)
+    return cached_result({'result': result}, get_ssr_data)
+
+
+def get_reviews_from_page(url, retry_on_rate_limit, get_ssr_data=False, throttle=True, budget=None):
     """Request single page and parse it.
     
     Args:
         str url: URL of the page to parse
         bool retry_on_rate_limit: when True, if rate limit is encountered on the remote, we will wait and retry
         bool get_ssr_data: when True, specific part of the page containing review rating distribution will be parsed as well
+        bool throttle: when True, the request is paced by the host's rate limiter and rescheduled after rate limit through fetch_pages()
+            (False if caller has already reserved the limiter)
+        threading.Semaphore budget: when specified, request is sent only while holding this semaphore (shared by several jobs)
     """
-    success, response_description, response = try_get_request(url, retry_on_rate_limit)
+    if ASYNC_ENGINE is not None:
+        return ASYNC_ENGINE.get_reviews_from_page_blocking(url, retry_on_rate_limit, get_ssr_data, budget)
+    if throttle:
+        return run_crawl(fetch_page(url, retry_on_rate_limit, get_ssr_data, budget))
+    result, entry, headers = lookup_page(url, get_ssr_data)
+    if result is not None:
+        return result
+    with budget or contextlib.nullcontext():
+        success, response_description, response = try_get_request(url, retry_on_rate_limit, headers)
     if not success:
         msg = 'Failed to load page %s' % (url)
         logger.warning(msg)
         return response_description, msg, 0, [], {}    
-    return parse_html(response.text, get_ssr_data, url, response_description)
+    encoding = None
+    if response.status_code != 304:
+        encoding = response.encoding or response.apparent_encoding
+    return parse_page(url, get_ssr_data, entry, response_description, response.status_code, response, response.content, encoding)
+
+
+def failed_result(url):
+    """Return result of get_reviews_from_page() standing in for a page that could not be processed (its processing raised)
+
+    Args:
+        str url: URL of the page
+    """
+    return 'Failed, page could not be processed', 'Failed to load page %s' % (url), 0, [], {}
 
 
 def page_url(base_url, star_rating, page_number, sort_by_oldest=False):
@@ -148,7 +653,594 @@ def page_url(base_url, star_rating, page_number, sort_by_oldest=False):
     return url
 
 
-def get_reviews(url, crawl=False, sort_by_oldest=False, retry_on_rate_limit=False, page_limit=0):
+def fetch_pages(urls, retry_on_rate_limit, concurrency=1, follow=None, budget=None, on_wait=None, get_ssr_data=False):
+    """Request and parse several pages through a bounded pool of worker threads, yielding results as pages complete.
+
+    Requests are paced by the host's rate limiter, while pages still fresh in the page cache are served without waiting for it.
+    Pages turned down with status code 429 are put back in the queue and sent again once the limiter allows, so no worker
+    sleeps while waiting (the calling thread does, while no other page is in flight). Pages whose processing raised are yielded (and followed) as failed_result(), so a crawl keeps
+    paging past them.
+
+    Args:
+        list urls: URLs of the pages to parse
+        bool retry_on_rate_limit: when True, if rate limit is encountered on the remote, we will wait and retry
+        int concurrency: maximum number of pages requested at the same time
+        object follow: when specified, called with URL and result of every processed page, returns list of URLs to request next
+        threading.Semaphore budget: when specified, requests are sent only while holding this semaphore (shared by several jobs)
+        object on_wait: when specified, called with number of seconds a page waits for the host's rate limiter
+        bool get_ssr_data: when True, specific part of the pages containing review rating distribution will be parsed as well
+    """
+    if ASYNC_ENGINE is not None:
+        yield from ASYNC_ENGINE.fetch_pages_blocking(urls, retry_on_rate_limit, concurrency, follow, budget, on_wait, get_ssr_data)
+        return
+    concurrency = max(1, min(concurrency, MAX_CRAWL_CONCURRENCY))
+    pending = collections.deque((next_url, 0) for next_url in urls)
+    delayed, running, sequence = [], {}, 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while pending or delayed or running:
+            now = time.monotonic()
+            while delayed and delayed[0][0] <= now:
+                _, _, next_url, attempt = heapq.heappop(delayed)
+                running[executor.submit(get_reviews_from_page, next_url, retry_on_rate_limit, get_ssr_data, False, budget)] = (next_url, attempt)
+            while pending and len(running) + len(delayed) < concurrency:
+                next_url, attempt = pending.popleft()
+                # pages served from cache never reach the remote, so they don't wait for the limiter
+                result = lookup_page(next_url, get_ssr_data)[0]
+                if result is not None:
+                    if follow is not None:
+                        pending.extend((following_url, 0) for following_url in follow(next_url, result))
+                    yield next_url, result
+                    continue
+                delay = rate_limiter(next_url).reserve()
+                if delay > 0:
+                    THROTTLE_WAIT.inc(delay)
+                    if on_wait is not None:
+                        on_wait(delay)
+                    sequence += 1
+                    heapq.heappush(delayed, (now + delay, sequence, next_url, attempt))
+                else:
+                    running[executor.submit(get_reviews_from_page, next_url, retry_on_rate_limit, get_ssr_data, False, budget)] = (next_url, attempt)
+            if not running:
+                if delayed:
+                    time.sleep(max(0.0, delayed[0][0] - time.monotonic()))
+                continue
+            timeout = max(0.0, delayed[0][0] - time.monotonic()) if delayed else None
+            done, _ = concurrent.futures.wait(running, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                next_url, attempt = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.warning('Failed to process page %s: %s' % (next_url, str(e)))
+                    result = failed_result(next_url)
+                if result[0] == 'Completed, status code 429' and retry_on_rate_limit and attempt < RATE_LIMIT_MAX_RETRIES:
+                    logger.info('Rescheduling %s after rate limit (retry %d of %d)' % (next_url, attempt+1, RATE_LIMIT_MAX_RETRIES))
+                    pending.appendleft((next_url, attempt+1))
+                    continue
+                if follow is not None:
+                    pending.extend((following_url, 0) for following_url in follow(next_url, result))
+                yield next_url, result
+
+
+# crawls (see crawl_reviews()) are generators that yield Fetch to ask for pages and are then handed the pages one by one,
+# so the same crawl runs either in a job thread (run_crawl()) or as a coroutine on the event loop (AsyncCrawlEngine.run_crawl())
+Fetch = collections.namedtuple('Fetch', ['urls', 'retry_on_rate_limit', 'concurrency', 'follow', 'budget', 'on_wait', 'get_ssr_data'], defaults=[1, None, None, None, False])
+# yielded by a crawl once it has processed a page, to be handed the next one (None when all pages it asked for were handed)
+NEXT_PAGE = object()
+
+
+def step_crawl(crawl, item=None):
+    """Advance crawl to its next request. Returns tuple (done, value): value is Fetch or NEXT_PAGE while the crawl runs, its result once done.
+
+    Args:
+        generator crawl: crawl (see crawl_reviews())
+        tuple item: page (url, result) the crawl asked for, or None once all pages it asked for were handed
+    """
+    try:
+        return False, crawl.send(item)
+    except StopIteration as e:
+        return True, e.value
+
+
+def run_crawl(crawl):
+    """Run crawl in the current thread, fetching the pages it asks for with fetch_pages(), and return its result.
+
+    Args:
+        generator crawl: crawl (see crawl_reviews())
+    """
+    done, command = step_crawl(crawl)
+    while not done:
+        for item in fetch_pages(*command):
+            done, command = step_crawl(crawl, item)
+        done, command = step_crawl(crawl)
+    return command
+
+
+def fetch_page(url, retry_on_rate_limit, get_ssr_data=False, budget=None):
+    """Ask for single page from within a crawl (result = yield from fetch_page(...)), returning the same as get_reviews_from_page().
+
+    Args:
+        str url: URL of the page to parse
+        bool retry_on_rate_limit: when True, if rate limit is encountered on the remote, we will wait and retry
+        bool get_ssr_data: when True, specific part of the page containing review rating distribution will be parsed as well
+        threading.Semaphore budget: when specified, request is sent only while holding this semaphore (shared by several jobs)
+    """
+    item = yield Fetch([url], retry_on_rate_limit, budget=budget, get_ssr_data=get_ssr_data)
+    result = item[1] if item is not None else failed_result(url)
+    while item is not None:
+        item = yield NEXT_PAGE
+    return result
+
+
+class AsyncCrawlEngine:
+    """Crawl engine sending requests with aiohttp from a single event loop running in a background thread.
+    Pages of all jobs are requested concurrently on that loop, rate-limit waits are non-blocking sleeps,
+    and CPU-bound parsing is handed off to an executor. Jobs run on the loop as crawls (see run_crawl() and AsyncJobScheduler),
+    other callers use blocking methods that mirror get_reviews_from_page() and fetch_pages(), so get_reviews() returns
+    exactly the same results with either engine.
+    """
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, parser=None):
+        """
+        Args:
+            int pool_size: maximum number of connections kept per host
+            concurrent.futures.Executor parser: executor to parse pages in (default executor of the loop if not specified)
+        """
+        if aiohttp is None:
+            raise RuntimeError('asyncio crawl engine requires aiohttp')
+        self.pool_size = pool_size
+        self.parser = parser
+        self.session = None
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name='crawl-event-loop', daemon=True).start()
+
+    async def get_session(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=self.pool_size),
+                timeout=aiohttp.ClientTimeout(sock_connect=HTTP_TIMEOUT[0], sock_read=HTTP_TIMEOUT[1]),
+                headers={'Accept-Encoding': 'gzip, deflate'})
+        return self.session
+
+    async def try_get_request(self, url, retry_on_rate_limit=True, headers=None, on_wait=None):
+        """Send GET request, same as try_get_request() but without holding a thread while waiting for rate limit.
+        Returns tuple (success, response_description, response, body).
+
+        Args:
+            str url: URL to send request to
+            bool retry_on_rate_limit: when True, if rate limit is encountered on the remote, we will wait and retry
+            dict headers: additional request headers (e.g. validators for conditional request)
+            object on_wait: when specified, called with number of seconds the request waits for the host's rate limiter
+        """
+        session = await self.get_session()
+        limiter = rate_limiter(url)
+        attempt = 0
+        while True:
+            delay = limiter.reserve()
+            if delay > 0:
+                logger.info('Throttling request to %s for %.2f s' % (url, delay))
+                THROTTLE_WAIT.inc(delay)
+                if on_wait is not None:
+                    on_wait(delay)
+                await asyncio.sleep(delay)
+            logger.info('Requesting %s' % (url))
+            try:
+                with STAGE_SECONDS.time(stage='fetch'):
+                    async with session.get(url, headers=headers) as response:
+                        body = await response.read()
+            except (aiohttp.InvalidURL, ValueError):
+                HTTP_REQUESTS.inc(status='error')
+                return False, 'Failed, invalid URL', None, None
+            except asyncio.TimeoutError:
+                HTTP_REQUESTS.inc(status='error')
+                return False, 'Failed, timeout', None, None
+            except aiohttp.ClientError:
+                HTTP_REQUESTS.inc(status='error')
+                return False, 'Failed, connection error', None, None
+            HTTP_REQUESTS.inc(status=str(response.status))
+            DOWNLOADED_BYTES.inc(len(body))
+            logger.info('Got response, status code %d' % (response.status))
+            if response.status in (200, 304):
+                limiter.recover()
+                return True, 'Completed, status code %s' % (response.status), response, body
+            elif response.status == 503:
+                logger.warning('Status code 503, not handled')
+            elif response.status == 429:
+                retry_after = parse_retry_after(response.headers.get('retry-after'))
+                logger.warning('Rate limit allows retrying in %d seconds' % (retry_after))
+                RATE_LIMIT_WAIT.inc(retry_after)
+                limiter.backoff(retry_after)
+                if retry_on_rate_limit and attempt < RATE_LIMIT_MAX_RETRIES:
+                    attempt += 1
+                    logger.info('Retrying in %d s (retry %d of %d)' % (retry_after, attempt, RATE_LIMIT_MAX_RETRIES))
+                    continue
+                logger.warning('Will not retry, moving on')
+            return False, 'Completed, status code %s' % (response.status), None, None
+
+    async def get_reviews_from_page(self, url, retry_on_rate_limit, get_ssr_data=False, on_wait=None):
+        """Request single page and parse it, same as get_reviews_from_page().
+
+        Args:
+            str url: URL of the page to parse
+            bool retry_on_rate_limit: when True, if rate limit is encountered on the remote, we will wait and retry
+            bool get_ssr_data: when True, specific part of the page containing review rating distribution will be parsed as well
+            object on_wait: when specified, called with number of seconds the request waits for the host's rate limiter
+        """
+        result, entry, headers = lookup_page(url, get_ssr_data)
+        if result is not None:
+            return result
+        success, response_description, response, body = await self.try_get_request(url, retry_on_rate_limit, headers, on_wait)
+        if not success:
+            msg = 'Failed to load page %s' % (url)
+            logger.warning(msg)
+            return response_description, msg, 0, [], {}
+        encoding = response.get_encoding() if response.status != 304 else None
+        return await self.loop.run_in_executor(self.parser, parse_page, url, get_ssr_data, entry, response_description, response.status, response, body, encoding)
+
+    def get_reviews_from_page_blocking(self, url, retry_on_rate_limit, get_ssr_data=False, budget=None):
+        """Request single page on the event loop and wait for the result (called from job threads).
+
+        Args:
+            str url: URL of the page to parse
+            bool retry_on_rate_limit: when True, if rate limit is encountered on the remote, we will wait and retry
+            bool get_ssr_data: when True, specific part of the page containing review rating distribution will be parsed as well
+            threading.Semaphore budget: when specified, request is sent only while holding this semaphore (shared by several jobs)
+        """
+        with budget or contextlib.nullcontext():
+            return asyncio.run_coroutine_threadsafe(self.get_reviews_from_page(url, retry_on_rate_limit, get_ssr_data), self.loop).result()
+
+    async def fetch_pages(self, urls, retry_on_rate_limit, concurrency=1, follow=None, budget=None, on_wait=None, get_ssr_data=False):
+        """Request and parse several pages on the event loop, yielding results as pages complete (same as fetch_pages()).
+        follow() is called only while the generator is iterated, never concurrently with the consumer.
+
+        Args:
+            list urls: URLs of the pages to parse
+            bool retry_on_rate_limit: when True, if rate limit is encountered on the remote, we will wait and retry
+            int concurrency: maximum number of pages requested at the same time
+            object follow: when specified, called with URL and result of every processed page, returns list of URLs to request next
+            threading.Semaphore budget: when specified, requests are sent only while holding this semaphore (shared by several jobs)
+            object on_wait: when specified, called (from the event loop thread) with number of seconds a page waits for the host's rate limiter
+            bool get_ssr_data: when True, specific part of the pages containing review rating distribution will be parsed as well
+        """
+        concurrency = max(1, min(concurrency, MAX_CRAWL_CONCURRENCY))
+        pending = collections.deque(urls)
+        running = {}
+        try:
+            while pending or running:
+                while pending and len(running) < concurrency:
+                    # budget is shared with job threads, so it is polled rather than waited for on the loop
+                    if budget is not None and not budget.acquire(blocking=False):
+                        if running:
+                            break
+                        await asyncio.sleep(BUDGET_POLL_INTERVAL)
+                        continue
+                    next_url = pending.popleft()
+                    task = asyncio.ensure_future(self.get_reviews_from_page(next_url, retry_on_rate_limit, get_ssr_data, on_wait))
+                    if budget is not None:
+                        task.add_done_callback(lambda _: budget.release())
+                    running[task] = next_url
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    next_url = running.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        logger.warning('Failed to process page %s: %s' % (next_url, str(e)))
+                        result = failed_result(next_url)
+                    if follow is not None:
+                        pending.extend(follow(next_url, result))
+                    yield next_url, result
+        finally:
+            for task in running:
+                task.cancel()
+
+    def fetch_pages_blocking(self, urls, retry_on_rate_limit, concurrency=1, follow=None, budget=None, on_wait=None, get_ssr_data=False):
+        """Request and parse several pages on the event loop, yielding results to the calling thread as pages complete (same as fetch_pages()).
+
+        Args:
+            list urls: URLs of the pages to parse
+            bool retry_on_rate_limit: when True, if rate limit is encountered on the remote, we will wait and retry
+            int concurrency: maximum number of pages requested at the same time
+            object follow: when specified, called (from the event loop thread) with URL and result of every processed page, returns list of URLs to request next
+            threading.Semaphore budget: when specified, requests are sent only while holding this semaphore (shared by several jobs)
+            object on_wait: when specified, called (from the event loop thread) with number of seconds a page waits for the host's rate limiter
+            bool get_ssr_data: when True, specific part of the pages containing review rating distribution will be parsed as well
+        """
+        pages = self.fetch_pages(urls, retry_on_rate_limit, concurrency, follow, budget, on_wait, get_ssr_data)
+        try:
+            while True:
+                try:
+                    yield asyncio.run_coroutine_threadsafe(pages.__anext__(), self.loop).result()
+                except StopAsyncIteration:
+                    return
+        finally:
+            asyncio.run_coroutine_threadsafe(pages.aclose(), self.loop).result()
+
+    async def run_crawl(self, crawl):
+        """Run crawl as a coroutine, fetching the pages it asks for on the event loop, and return its result.
+        Steps of the crawl (merging pages, storing reviews, publishing progress) run in the default executor of the loop,
+        so only a thread per step in progress is held, not a thread per crawl.
+
+        Args:
+            generator crawl: crawl (see crawl_reviews())
+        """
+        done, command = await self.loop.run_in_executor(None, step_crawl, crawl)
+        while not done:
+            pages = self.fetch_pages(*command)
+            try:
+                async for item in pages:
+                    done, command = await self.loop.run_in_executor(None, step_crawl, crawl, item)
+            finally:
+                await pages.aclose()
+            done, command = await self.loop.run_in_executor(None, step_crawl, crawl)
+        return command
+
+    def close(self):
+        """Close HTTP session and stop the event loop"""
+        async def close_session():
+            if self.session is not None:
+                await self.session.close()
+        asyncio.run_coroutine_threadsafe(close_session(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+# pool raw page bodies are sent to for parsing (None when pages are parsed in the requesting thread);
+# created once parsing functions are defined, so forked workers can run them, and before any thread is started
+PARSE_POOL = create_parse_pool(PARSE_WORKERS) if PARSE_WORKERS > 0 else None
+
+# engine serving all page requests when asyncio engine is selected (None when pages are requested from threads)
+ASYNC_ENGINE = AsyncCrawlEngine() if CRAWL_ENGINE == 'asyncio' else None
+
+
+def observe_job(pages, reviews):
+    """Record number of pages processed and reviews returned by get_reviews() call.
+
+    Args:
+        int pages: number of pages processed
+        int reviews: number of reviews returned
+    """
+    JOB_PAGES.observe(pages)
+    JOB_REVIEWS.observe(reviews)
+
+
+class JobProgress:
+    """Progress of a crawl (pages planned and done, reviews collected, star rating of the last page, seconds waited for rate limit),
+    published through a callback every time it changes
+    """
+
+    def __init__(self, publish=None):
+        """
+        Args:
+            object publish: when specified, called with progress as dict every time it changes
+        """
+        self.publish = publish
+        self.pages_planned = 1
+        self.pages_done = 0
+        self.reviews = 0
+        self.star_rating = None
+        self.waits = []
+
+    def wait(self, seconds):
+        """Record time a page waits for rate limiter (may be called from other threads, published with next update)"""
+        self.waits.append(seconds)
+
+    def update(self, **values):
+        """Set progress values and publish them"""
+        for name, value in values.items():
+            setattr(self, name, value)
+        if self.publish is not None:
+            self.publish(self.as_dict())
+
+    def as_dict(self):
+        return {'pages_planned': self.pages_planned, 'pages_done': self.pages_done, 'reviews': self.reviews, 'star_rating': self.star_rating, 'rate_limit_wait': round(sum(self.waits), 3)}
+
+
+def page_loaded(result):
+    """Return True if result of get_reviews_from_page() comes from a page that loaded (as opposed to a failed request or rate limit)
+
+    Args:
+        tuple result: result of get_reviews_from_page()
+    """
+    return result[2] > 0 and result[0] in ('Completed, status code 200', 'Completed, status code 304')
+
+
+def crawl_new_reviews(url, retry_on_rate_limit=False, page_limit=0, concurrency=1, on_reviews=None, budget=None, on_progress=None):
+    """Crawl re-crawling a listing and returning only reviews that are new or changed since the listing was crawled last time (see crawl_reviews()).
+    Pages are requested newest-first, only for star ratings whose review count has changed, and paging through
+    a star rating stops at the first page that holds nothing but known reviews. A star rating is recorded as crawled
+    (its new review count is stored) only when all of its pages loaded; otherwise it is crawled again in full next time.
+
+    Args:
+        str url: URL to process
+        bool retry_on_rate_limit: when True, if rate limit is encountered on the remote, we will wait and retry
+        int page_limit: when >= 0, limit number of requested pages per each star rating to this number
+        int concurrency: maximum number of pages requested at the same time
+        object on_reviews: when specified, called with dict of new or changed reviews from every processed page
+        threading.Semaphore budget: when specified, requests are sent only while holding this semaphore (shared by several jobs)
+        object on_progress: when specified, called with progress of the crawl as dict every time a page is processed
+    """
+    progress = JobProgress(on_progress)
+    base_url = url.split('?')[0]
+    state = LISTINGS.get(base_url) or {'reviews': {}, 'latest_date': None, 'rating_distribution': []}
+    known = state['reviews']
+    # ratings some pages of which failed to load last time, so their known reviews don't mean the rest was seen
+    resumed = set(state.get('incomplete', []))
+    incomplete = set()
+    last_response_description, last_msg, total_reviews, rating_distribution, reviews = yield from fetch_page(url, retry_on_rate_limit, get_ssr_data=True, budget=budget)
+    pages_processed = 1
+    progress.update(pages_done=pages_processed, reviews=len(reviews))
+    if total_reviews == 0:
+        logger.warning('Did not get any reviews from requested page')
+        observe_job(pages_processed, 0)
+        return {'http_response': last_response_description, 'job_status': last_msg, 'data': {}}
+    if on_reviews is not None:
+        on_reviews({k: v for k, v in reviews.items() if known.get(k) != store.review_digest(v)})
+    if rating_distribution and state['rating_distribution']:
+        changed_ratings = [star_rating for star_rating in range(1, 6) if rating_distribution[star_rating-1] != state['rating_distribution'][star_rating-1] or star_rating in resumed]
+    else:
+        changed_ratings = [star_rating for star_rating in range(1, 6) if not rating_distribution or rating_distribution[star_rating-1] > 0]
+    if total_reviews > len(reviews) and changed_ratings:
+        logger.info('Review count changed for rating%s %s, crawling newest first' % ('s' if len(changed_ratings) != 1 else '', ', '.join(str(x) for x in changed_ratings)))
+        pages = {}
+        for star_rating in changed_ratings:
+            pages[page_url(base_url, star_rating, 1)] = (star_rating, 1)
+        progress.update(pages_planned=1 + len(pages))
+
+        def follow(next_url, result):
+            star_rating, page_number = pages[next_url]
+            got_reviews = result[4]
+            if not page_loaded(result):
+                logger.warning('Page %d of rating=%d did not load, rating will be crawled again next time' % (page_number, star_rating))
+                incomplete.add(star_rating)
+                return []
+            if star_rating not in resumed and not any(known.get(k) != store.review_digest(v) for k, v in got_reviews.items()):
+                logger.info('Reached known reviews for rating=%d at page %d' % (star_rating, page_number))
+                return []
+            if not rating_distribution and len(got_reviews) < REVIEWS_PER_PAGE:
+                return []
+            expected_pages_count = math.ceil((rating_distribution[star_rating-1] if rating_distribution else total_reviews) / REVIEWS_PER_PAGE)
+            if page_number >= expected_pages_count:
+                return []
+            if page_limit > 0 and page_number >= page_limit:
+                incomplete.add(star_rating)
+                return []
+            following_url = page_url(base_url, star_rating, page_number+1)
+            pages[following_url] = (star_rating, page_number+1)
+            return [following_url]
+
+        item = yield Fetch(list(pages.keys()), retry_on_rate_limit, concurrency, follow, budget, progress.wait)
+        while item is not None:
+            page, (last_response_description, last_msg, _, _, got_reviews) = item
+            pages_processed += 1
+            with STAGE_SECONDS.time(stage='merge'):
+                if on_reviews is not None:
+                    on_reviews({k: v for k, v in got_reviews.items() if k not in reviews and known.get(k) != store.review_digest(v)})
+                reviews.update(got_reviews)
+            progress.update(pages_planned=1 + len(pages), pages_done=pages_processed, reviews=len(reviews), star_rating=pages[page][0])
+            item = yield NEXT_PAGE
+    else:
+        logger.info('Review counts did not change since last crawl')
+    digests = {k: store.review_digest(v) for k, v in reviews.items()}
+    new_reviews = {k: v for k, v in reviews.items() if known.get(k) != digests[k]}
+    known.update(digests)
+    dates = [v['date'] for v in reviews.values()] + ([state['latest_date']] if state['latest_date'] else [])
+    stored_distribution = state['rating_distribution']
+    if rating_distribution:
+        # ratings not crawled in full keep their previous count, so they count as changed next time
+        previous = stored_distribution or [None] * 5
+        stored_distribution = [previous[i] if i+1 in incomplete else rating_distribution[i] for i in range(5)]
+    LISTINGS[base_url] = {'reviews': known, 'latest_date': max(dates) if dates else None, 'rating_distribution': stored_distribution, 'incomplete': sorted(incomplete)}
+    logger.info('Got %d new or changed reviews from %s' % (len(new_reviews), url))
+    observe_job(pages_processed, len(new_reviews))
+    return {'http_response': last_response_description, 'job_status': '%s; new or changed since last crawl: %d' % (last_msg, len(new_reviews)), 'data': new_reviews}
+
+
+class CrawlPlan:
+    """Plan of pages to request when crawling a listing, stratified by star rating, then by page number.
+
+    Star ratings with a known review count get their expected pages, requested a few at a time per rating,
+    while ratings with unknown count (no ratingDistribution on the first page) are probed with their first page
+    and followed while pages come back full. Ratings whose reviews were all on the first page are skipped,
+    and paging through a rating stops as soon as a page after its first one brings no new reviews.
+    """
+
+    def __init__(self, url, total_reviews, rating_distribution, reviews, page_limit=0, sort_by_oldest=False, window=1):
+        """
+        Args:
+            str url: URL of the first page (already processed)
+            int total_reviews: number of reviews of the listing
+            list rating_distribution: number of reviews per star rating (empty if unknown)
+            dict reviews: reviews collected so far (updated by the caller as pages are processed)
+            int page_limit: when > 0, limit number of requested pages per each star rating to this number
+            bool sort_by_oldest: when True, pages are requested with reviews sorted 'oldest to newest'
+            int window: number of pages of the same star rating requested at the same time
+        """
+        self.url = url
+        self.base_url = url.split('?')[0]
+        self.total_reviews = total_reviews
+        self.rating_distribution = rating_distribution
+        self.reviews = reviews
+        self.page_limit = page_limit
+        self.sort_by_oldest = sort_by_oldest
+        self.window = max(1, min(window, MAX_CRAWL_CONCURRENCY))
+        self.pages = {}
+        self.last_page = {}
+        self.next_page = {}
+        self.planned = 0
+
+    def queue(self, star_rating):
+        """Return URL of the next page of a star rating, or None if there are no more pages to request"""
+        page_number = self.next_page[star_rating]
+        last_page = self.last_page[star_rating]
+        if last_page is not None and page_number > last_page:
+            return None
+        self.next_page[star_rating] = page_number + 1
+        next_url = page_url(self.base_url, star_rating, page_number, self.sort_by_oldest)
+        if next_url == self.url:
+            logger.info('Page %d of rating=%d was already processed' % (page_number, star_rating))
+            if last_page is not None:
+                self.planned -= 1
+            return self.queue(star_rating)
+        if last_page is None:
+            # pages of ratings with unknown review count are planned one by one, as long as pages come back full
+            self.planned += 1
+        self.pages[next_url] = (star_rating, page_number)
+        return next_url
+
+    def stop(self, star_rating):
+        """Stop requesting pages of a star rating, dropping pages not requested yet from the plan"""
+        last_page = self.last_page[star_rating]
+        if last_page is not None:
+            self.planned -= sum(1 for page_number in range(self.next_page[star_rating], last_page + 1) if page_url(self.base_url, star_rating, page_number, self.sort_by_oldest) != self.url)
+        self.last_page[star_rating] = 0
+
+    def initial_urls(self):
+        """Return URLs to request first"""
+        collected = collections.Counter(review.get('rating') for review in self.reviews.values())
+        urls = []
+        for star_rating in range(1, 6):
+            if self.rating_distribution:
+                expected_reviews = self.rating_distribution[star_rating-1]
+                if expected_reviews <= collected[star_rating]:
+                    continue
+                expected_pages_count = math.ceil(expected_reviews / REVIEWS_PER_PAGE)
+                logger.info('Star rating %d: expecting %d page%s' % (star_rating, expected_pages_count, 's' if expected_pages_count != 1 else ''))
+                window = self.window
+            else:
+                expected_pages_count = None
+                logger.info('Star rating %d: review count unknown, probing first page' % (star_rating))
+                window = 1
+            if self.page_limit > 0 and (expected_pages_count is None or expected_pages_count > self.page_limit):
+                logger.warning('Will not process pages beyond page %d' % self.page_limit)
+                expected_pages_count = self.page_limit
+            self.last_page[star_rating] = expected_pages_count
+            self.next_page[star_rating] = 1
+            if expected_pages_count is not None:
+                self.planned += expected_pages_count
+            for _ in range(window):
+                next_url = self.queue(star_rating)
+                if next_url is None:
+                    break
+                urls.append(next_url)
+        return urls
+
+    def follow(self, next_url, result):
+        """Return URLs to request after a page was processed (passed to fetch_pages())"""
+        star_rating, page_number = self.pages[next_url]
+        got_reviews = result[4]
+        # first page of a rating may repeat reviews of the listing's first page, later pages repeat only when paging went past the end
+        if page_number > 1 and result[2] > 0 and not any(k not in self.reviews for k in got_reviews):
+            logger.info('Page %d of rating=%d brought no new reviews, not requesting further pages of this rating' % (page_number, star_rating))
+            self.stop(star_rating)
+            return []
+        if not self.rating_distribution and len(got_reviews) < REVIEWS_PER_PAGE:
+            self.stop(star_rating)
+            return []
+        following_url = self.queue(star_rating)
+        return [following_url] if following_url is not None else []
+
+
+def get_reviews(url, crawl=False, sort_by_oldest=False, retry_on_rate_limit=False, page_limit=0, concurrency=1, incremental=False, on_reviews=None, budget=None, on_progress=None):
     """Process one or more pages starting with specified URL and return collected reviews.
     
     Args:
@@ -157,44 +1249,92 @@ def get_reviews(url, crawl=False, sort_by_oldest=False, retry_on_rate_limit=Fals
         bool sort_by_oldest: when True, additional pages will be loaded when reviews are sorted 'oldest to newest'
         bool retry_on_rate_limit: when True, if rate limit is encountered on the remote, we will wait and retry
         int page_limit: when >= 0, limit number of requested pages per each star rating to this number
+        int concurrency: when crawling, maximum number of pages requested at the same time
+        bool incremental: when True, crawl newest-first and return only reviews that are new or changed since the listing was crawled last time (crawl and sort_by_oldest are ignored)
+        object on_reviews: when specified, called with dict of reviews not seen before from every processed page, as soon as the page is processed
+        threading.Semaphore budget: when specified, requests are sent only while holding this semaphore (shared by several jobs)
+        object on_progress: when specified, called with progress of the crawl as dict every time it changes
     """
+    return run_crawl(crawl_reviews(url, crawl, sort_by_oldest, retry_on_rate_limit, page_limit, concurrency, incremental, on_reviews, budget, on_progress))
+
+
+def crawl_reviews(url, crawl=False, sort_by_oldest=False, retry_on_rate_limit=False, page_limit=0, concurrency=1, incremental=False, on_reviews=None, budget=None, on_progress=None):
+    """Crawl returning the same as get_reviews() (same parameters): generator that yields Fetch to ask for pages,
+    is then handed (url, result) of every page (yielding NEXT_PAGE after each) and None once all pages were handed,
+    and returns the result. Run it with run_crawl() or AsyncCrawlEngine.run_crawl().
+    """
+    if incremental:
+        return (yield from crawl_new_reviews(url, retry_on_rate_limit, page_limit, concurrency, on_reviews, budget, on_progress))
+    progress = JobProgress(on_progress)
     # get first page and check if we have all the reviews with one shot
-    last_response_description, last_msg, total_reviews, rating_distribution, reviews = get_reviews_from_page(url, retry_on_rate_limit, get_ssr_data=True)
+    last_response_description, last_msg, total_reviews, rating_distribution, reviews = yield from fetch_page(url, retry_on_rate_limit, get_ssr_data=True, budget=budget)
+    if on_reviews is not None and reviews:
+        on_reviews(dict(reviews))
+    pages_processed = 1
+    progress.update(pages_done=pages_processed, reviews=len(reviews))
     if total_reviews == 0:
         logger.warning('Did not get any reviews from requested page')
+        observe_job(pages_processed, len(reviews))
         return {'http_response': last_response_description, 'job_status': last_msg, 'data': reviews}
     elif total_reviews == len(reviews) or not crawl:
         logger.info('%s' % ('Got all reviews in one go' if crawl else 'Got reviews from requested page (will not look further)'))
+        observe_job(pages_processed, len(reviews))
         return {'http_response': last_response_description, 'job_status': last_msg, 'data': reviews}
     logger.info('Reviews take more than 1 page, will try crawling')
-    # stratify by star rating, then by page number
-    if not rating_distribution:
-        rating_distribution = [total_reviews] * 5
-    base_url = url.split('?')[0]
-    got_reviews = {}
-    processed_pages = {}
-    for star_rating in range(1, 6):
-        if rating_distribution[star_rating-1] == 0:
-            continue
-        expected_pages_count = math.ceil(rating_distribution[star_rating-1] / 25)
-        if star_rating in processed_pages and processed_pages[star_rating] == expected_pages_count:
-            logger.info('Already got all pages for rating=%d' % (star_rating))
-            continue
-        logger.info('Star rating %d: expecting %d page%s' % (star_rating, expected_pages_count, 's' if expected_pages_count != 1 else ''))
-        for page_number in range(1, expected_pages_count+1):
-            if page_limit > 0 and page_number > page_limit:
-                logger.warning('Will not process pages beyond page %d' % page_limit)
-                break
-            next_url = page_url(base_url, star_rating, page_number, sort_by_oldest)
-            try:
-                last_response_description, last_msg, _, _, got_reviews = get_reviews_from_page(next_url, retry_on_rate_limit)
-                processed_pages[star_rating] = page_number
-            except:
-                pass
+    plan = CrawlPlan(url, total_reviews, rating_distribution, reviews, page_limit, sort_by_oldest, concurrency)
+    planned_urls = plan.initial_urls()
+    logger.info('Planned %d page%s, requesting up to %d at a time' % (plan.planned, 's' if plan.planned != 1 else '', max(1, min(concurrency, MAX_CRAWL_CONCURRENCY))))
+    progress.update(pages_planned=plan.planned + 1)
+    item = yield Fetch(planned_urls, retry_on_rate_limit, concurrency, plan.follow, budget, progress.wait)
+    while item is not None:
+        page, (last_response_description, last_msg, _, _, got_reviews) = item
+        pages_processed += 1
+        with STAGE_SECONDS.time(stage='merge'):
+            if on_reviews is not None:
+                on_reviews({k: v for k, v in got_reviews.items() if k not in reviews})
             reviews.update(got_reviews)
-            logger.info('Total reviews collected so far: %d (%s)' % (len(reviews), url))
+        # plan grows and shrinks as ratings are followed or cut short
+        progress.update(pages_planned=plan.planned + 1, pages_done=pages_processed, reviews=len(reviews), star_rating=plan.pages[page][0])
+        logger.info('Total reviews collected so far: %d (%s)' % (len(reviews), url))
+        item = yield NEXT_PAGE
     logger.info('Got %d reviews from %s' % (len(reviews), url))
-    return {'http_response': last_response_description, 'job_status': last_msg, 'data': reviews}
+    observe_job(pages_processed, len(reviews))
+    return {'http_response': last_response_description, 'job_status': '%s; pages planned: %d, requested: %d' % (last_msg, plan.planned + 1, pages_processed), 'data': reviews}
+
+
+# notified every time a job of this process changes, so clients waiting for progress wake up right away
+JOB_EVENTS = threading.Condition()
+
+
+def notify_job_change():
+    with JOB_EVENTS:
+        JOB_EVENTS.notify_all()
+
+
+def publish_progress(job_id, progress):
+    """Store progress of a running job and wake up clients waiting for it to change.
+
+    Args:
+        str job_id: ID of a job
+        dict progress: progress as published by get_reviews()
+    """
+    try:
+        JOBS.update_header(job_id, {'progress': progress})
+    except KeyError:
+        logger.warning('Job %s is gone, dropping its progress' % (job_id))
+        return
+    notify_job_change()
+
+
+def set_job(job_id, result):
+    """Store result of a job and wake up clients waiting for it to change.
+
+    Args:
+        str job_id: ID of a job
+        dict result: result to store
+    """
+    JOBS[job_id] = result
+    notify_job_change()
 
 
 def run_job(job_id, method, *args, **kwargs):
@@ -205,10 +1345,344 @@ def run_job(job_id, method, *args, **kwargs):
         object method: procedure to execute (expected to return iterable with at least 3 items)
         *args, **kwargs: parameters for method
     """
-    global JOBS
-    JOBS[job_id] = {'http_response': 'N/A', 'job_status': 'In progress', 'data': {}}
-    result = method(*args, **kwargs)
-    JOBS[job_id] = result
+    set_job(job_id, {'http_response': 'N/A', 'job_status': 'In progress', 'data': {}})
+    set_job(job_id, method(*args, **kwargs))
+
+
+class JobScheduler:
+    """Bounded queue of jobs executed by a fixed pool of worker threads"""
+
+    def __init__(self, workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE):
+        """
+        Args:
+            int workers: number of jobs executed at the same time
+            int queue_size: number of jobs allowed to wait for a worker
+        """
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.running = set()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def _work(self):
+        while True:
+            job_id, method, args, kwargs = self.queue.get()
+            with self.lock:
+                self.running.add(job_id)
+            try:
+                run_job(job_id, method, *args, **kwargs)
+            except Exception as e:
+                logger.exception('Job %s failed' % (job_id))
+                set_job(job_id, {'http_response': 'N/A', 'job_status': 'Failed: %s' % (str(e)), 'data': {}})
+            finally:
+                with self.lock:
+                    self.running.discard(job_id)
+                self.queue.task_done()
+
+    def submit(self, job_id, method, *args, **kwargs):
+        """Put job in the queue, return False if the queue is full.
+
+        Args:
+            str job_id: ID of a job to store
+            object method: procedure to execute
+            *args, **kwargs: parameters for method
+        """
+        with self.lock:
+            while len(self.threads) < self.workers:
+                t = threading.Thread(target=self._work, name='job-worker-%d' % (len(self.threads)), daemon=True)
+                t.start()
+                self.threads.append(t)
+        try:
+            self.queue.put_nowait((job_id, method, args, kwargs))
+        except queue.Full:
+            logger.warning('Job queue is full, refusing job %s' % (job_id))
+            return False
+        return True
+
+    def status(self):
+        """Return number of jobs waiting in the queue and IDs of jobs being executed"""
+        with self.lock:
+            running = sorted(self.running)
+        return {'workers': self.workers, 'queued': self.queue.qsize(), 'running': running}
+
+
+class AsyncJobScheduler:
+    """Bounded set of jobs run as crawls on the event loop of the asyncio engine, so the number of listings crawled
+    at the same time is not tied to the number of threads (see AsyncCrawlEngine.run_crawl())
+    """
+
+    def __init__(self, engine, workers=ASYNC_JOBS, queue_size=JOB_QUEUE_SIZE):
+        """
+        Args:
+            AsyncCrawlEngine engine: engine whose event loop runs the jobs
+            int workers: number of jobs executed at the same time
+            int queue_size: number of jobs allowed to wait for their turn
+        """
+        self.engine = engine
+        self.workers = workers
+        self.queue_size = queue_size
+        self.slots = None
+        self.queued = 0
+        self.running = set()
+        self.lock = threading.Lock()
+
+    async def _work(self, job_id, method, args, kwargs):
+        loop = asyncio.get_running_loop()
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.workers)
+        async with self.slots:
+            with self.lock:
+                self.queued -= 1
+                self.running.add(job_id)
+            try:
+                await loop.run_in_executor(None, set_job, job_id, {'http_response': 'N/A', 'job_status': 'In progress', 'data': {}})
+                result = await self.engine.run_crawl(method(*args, **kwargs))
+                await loop.run_in_executor(None, set_job, job_id, result)
+            except Exception as e:
+                logger.exception('Job %s failed' % (job_id))
+                await loop.run_in_executor(None, set_job, job_id, {'http_response': 'N/A', 'job_status': 'Failed: %s' % (str(e)), 'data': {}})
+            finally:
+                with self.lock:
+                    self.running.discard(job_id)
+
+    def submit(self, job_id, method, *args, **kwargs):
+        """Schedule job on the event loop, return False if too many jobs wait for their turn.
+
+        Args:
+            str job_id: ID of a job to store
+            object method: function returning crawl to run (e.g. crawl_reviews())
+            *args, **kwargs: parameters for method
+        """
+        with self.lock:
+            if self.queued >= self.queue_size:
+                logger.warning('Job queue is full, refusing job %s' % (job_id))
+                return False
+            self.queued += 1
+        asyncio.run_coroutine_threadsafe(self._work(job_id, method, args, kwargs), self.engine.loop)
+        return True
+
+    def status(self):
+        """Return number of jobs waiting for their turn and IDs of jobs being executed"""
+        with self.lock:
+            return {'workers': self.workers, 'queued': self.queued, 'running': sorted(self.running)}
+
+
+# scheduler executing asynchronous jobs requested via POST
+SCHEDULER = AsyncJobScheduler(ASYNC_ENGINE) if ASYNC_ENGINE is not None else JobScheduler()
+METRICS.gauge('screview_job_queue_depth', 'Jobs waiting in the queue', callback=lambda: SCHEDULER.status()['queued'])
+METRICS.gauge('screview_jobs_running', 'Jobs being executed by background workers', callback=lambda: len(SCHEDULER.status()['running']))
+METRICS.counter('screview_connections_opened_total', 'Connections opened by the shared HTTP session', callback=lambda: connection_stats()['connections_opened'])
+METRICS.counter('screview_connections_reused_total', 'Requests sent over kept-alive connections of the shared HTTP session', callback=lambda: connection_stats()['connections_reused'])
+METRICS.counter('screview_page_cache_hits_total', 'Pages served from cache without contacting the remote', callback=lambda: PAGE_CACHE.stats()['hits'])
+METRICS.counter('screview_page_cache_revalidations_total', 'Pages served from cache after 304 response', callback=lambda: PAGE_CACHE.stats()['revalidations'])
+METRICS.counter('screview_page_cache_misses_total', 'Pages downloaded and parsed', callback=lambda: PAGE_CACHE.stats()['misses'])
+
+# jobs queued or running in this process, by normalized URL and crawl options, so identical requests attach to them
+INFLIGHT = {}
+INFLIGHT_LOCK = threading.Lock()
+
+
+def new_job_id():
+    """Return ID for a new job (random UUID, so processes sharing the job store never hand out the same ID)"""
+    return str(uuid.uuid4())
+
+
+def parse_job_options(parameters):
+    """Read crawl options for get_reviews() from request parameters.
+
+    Args:
+        dict parameters: request parameters (values are expected to be strings 'true'/'false' and digits, but JSON booleans and numbers are accepted too)
+    """
+    def flag(name):
+        return str(parameters[name]).lower() == 'true' if name in parameters else False
+
+    def number(name, default):
+        return int(parameters[name]) if name in parameters and str(parameters[name]).isdigit() else default
+
+    return {'crawl': flag('crawl'), 'sort_by_oldest': flag('oldest_first'), 'retry_on_rate_limit': flag('retry_on_rate_limit'),
+            'page_limit': number('page_limit', 0), 'concurrency': number('concurrency', 1), 'incremental': flag('incremental')}
+
+
+def job_key(url, options):
+    """Return key identifying requests that would produce the same result: normalized URL (base URL when crawling) and crawl options.
+
+    Args:
+        str url: URL to process
+        dict options: options for get_reviews()
+    """
+    parts = urllib.parse.urlsplit(url)
+    query = '' if options['crawl'] or options['incremental'] else '&'.join(sorted(parts.query.split('&')))
+    normalized_url = urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), query, ''))
+    return normalized_url, options['crawl'], options['sort_by_oldest'], options['retry_on_rate_limit'], options['page_limit'], options['incremental']
+
+
+def store_reviews(job_id, reviews):
+    """Add reviews to the result of a running job and to the index of reviews seen by any job.
+
+    Args:
+        str job_id: ID of the job
+        dict reviews: reviews by URL
+    """
+    JOBS.append_reviews(job_id, reviews)
+    REVIEWS.record(job_id, reviews)
+
+
+@contextlib.contextmanager
+def coalesced_job(job_id, key):
+    """Stop attaching new requests to the job once the with-block is left, whether the job succeeded or not.
+
+    Args:
+        str job_id: ID of the job
+        tuple key: key the job is registered with in INFLIGHT
+    """
+    try:
+        yield
+    finally:
+        with INFLIGHT_LOCK:
+            if INFLIGHT.get(key) == job_id:
+                del INFLIGHT[key]
+
+
+def run_coalesced_job(job_id, key, *args, **kwargs):
+    """Run get_reviews() on behalf of all requests attached to the job, then stop attaching new ones.
+
+    Args:
+        str job_id: ID of the job
+        tuple key: key the job is registered with in INFLIGHT
+        *args, **kwargs: parameters for get_reviews()
+    """
+    with coalesced_job(job_id, key):
+        result = get_reviews(*args, **kwargs)
+        REVIEWS.record(job_id, result['data'])
+        return result
+
+
+def crawl_coalesced_job(job_id, key, *args, **kwargs):
+    """Same as run_coalesced_job(), as a crawl run by AsyncJobScheduler.
+
+    Args:
+        str job_id: ID of the job
+        tuple key: key the job is registered with in INFLIGHT
+        *args, **kwargs: parameters for crawl_reviews()
+    """
+    with coalesced_job(job_id, key):
+        result = yield from crawl_reviews(*args, **kwargs)
+        REVIEWS.record(job_id, result['data'])
+        return result
+
+
+def submit_job(url, options, budget=None):
+    """Queue job processing specified URL, unless the same job is already queued or running.
+    Returns tuple (job_id, coalesced), job_id is None if the queue is full.
+
+    Args:
+        str url: URL to process
+        dict options: options for get_reviews()
+        threading.Semaphore budget: when specified, pages are requested only while holding this semaphore (shared by several jobs)
+    """
+    key = job_key(url, options)
+    with INFLIGHT_LOCK:
+        if key in INFLIGHT:
+            logger.info('Attaching request for %s to job %s' % (url, INFLIGHT[key]))
+            return INFLIGHT[key], True
+        job_id = new_job_id()
+        INFLIGHT[key] = job_id
+        JOBS[job_id] = {'http_response': 'N/A', 'job_status': 'Requested', 'data': {}}
+        # with the asyncio engine jobs are crawls run on the event loop
+        method = crawl_coalesced_job if ASYNC_ENGINE is not None else run_coalesced_job
+        if not SCHEDULER.submit(job_id, method, job_id, key, url, on_reviews=functools.partial(store_reviews, job_id), on_progress=functools.partial(publish_progress, job_id), budget=budget, **options):
+            del INFLIGHT[key]
+            del JOBS[job_id]
+            return None, False
+    return job_id, False
+
+
+def dump_json(value):
+    """Serialize value into JSON encoded as UTF-8 (with orjson when it is installed).
+
+    Args:
+        object value: JSON-serializable value
+    """
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf8')
+
+
+class SerializedResult:
+    """Result serialized once, along with its ETag and compressed bodies (each compressed on first request for it)"""
+
+    def __init__(self, value):
+        """
+        Args:
+            object value: JSON-serializable result
+        """
+        self.body = dump_json(value)
+        self.etag = hashlib.sha1(self.body).hexdigest()
+        self.bodies = {'identity': self.body}
+        self.lock = threading.Lock()
+
+    def encode(self, encoding):
+        """Return body compressed with specified encoding ('identity', 'gzip' or 'br')"""
+        with self.lock:
+            if encoding not in self.bodies:
+                self.bodies[encoding] = brotli.compress(self.body) if encoding == 'br' else gzip.compress(self.body, compresslevel=6)
+            return self.bodies[encoding]
+
+    def response(self):
+        """Build response to current request: 304 if the client has this result already, compressed body if the client accepts it"""
+        encoding = 'identity'
+        if len(self.body) >= RESULT_COMPRESS_MIN_SIZE:
+            if brotli is not None and request.accept_encodings['br'] > 0:
+                encoding = 'br'
+            elif request.accept_encodings['gzip'] > 0:
+                encoding = 'gzip'
+        etag = self.etag if encoding == 'identity' else '%s-%s' % (self.etag, encoding)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(self.encode(encoding), mimetype='application/json')
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+class ResultCache:
+    """LRU cache of serialized results of finished jobs, so polling clients don't get them serialized over and over"""
+
+    def __init__(self, size=RESULT_CACHE_SIZE):
+        """
+        Args:
+            int size: maximum number of results kept
+        """
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, job_id, header, load):
+        """Return serialized result of a job, serializing it only if it is not cached or the job has changed since.
+
+        Args:
+            str job_id: ID of a job
+            dict header: job result without reviews, as currently stored
+            object load: called to load whole result when it has to be serialized
+        """
+        with self.lock:
+            entry = self.entries.get(job_id)
+            if entry is not None and entry[0] == header:
+                self.entries.move_to_end(job_id)
+                return entry[1]
+        serialized = SerializedResult(load())
+        with self.lock:
+            self.entries[job_id] = (header, serialized)
+            self.entries.move_to_end(job_id)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return serialized
+
+
+RESULT_CACHE = ResultCache()
 
 
 # Views
@@ -216,16 +1690,16 @@ def run_job(job_id, method, *args, **kwargs):
 @app.route('/', methods=['GET', 'POST'])
 def scrape():
     """Get parameters and either parse single page right away and return the results,
-    or start job in a separate thread and return endpoint to retrieve the results later.
+    or queue job for a background worker and return endpoint to retrieve the results later.
     """
     global JOBS
     if request.method == 'GET':
         # parse single page
         url = request.args['url']
         result = get_reviews(url=url)
-        return result
+        return SerializedResult(result).response()
     elif request.method == 'POST':
-        # promise to parse what is requested, and execute in a separate thread
+        # promise to parse what is requested, and put it in the job queue
         parameters = {}
         try:
             parameters = request.get_json()
@@ -233,10 +1707,7 @@ def scrape():
             return Response("{'status_code': '400', 'message': 'request parameters have not been provided'}", status=400, mimetype='application/json')
         
         url = parameters['url'] if 'url' in parameters else None
-        crawl = parameters['crawl'].lower() == 'true' if 'crawl' in parameters else False
-        sort_oldest_first = parameters['oldest_first'].lower() == 'true' if 'oldest_first' in parameters else False
-        retry_on_rate_limit = parameters['retry_on_rate_limit'].lower() == 'true' if 'retry_on_rate_limit' in parameters else False
-        page_limit = int(parameters['page_limit']) if 'page_limit' in parameters and parameters['page_limit'].isdigit() else 0
+        options = parse_job_options(parameters)
 
         if url is None:
             return Response("{'status_code': '400', 'message': 'remote URL has not been provided'}", status=400, mimetype='application/json')
@@ -244,29 +1715,222 @@ def scrape():
         if not url.startswith('https://www.productreview.com.au/listings/'):
             return Response("{'status_code': '400', 'message': 'remote URL is invalid'}", status=400, mimetype='application/json')
             
-        job_id = str(datetime.datetime.timestamp(datetime.datetime.now()))
-        JOBS[job_id] = {'http_response': 'N/A', 'job_status': 'Requested', 'data': {}}
-        t = threading.Thread(target=run_job, args=(job_id, get_reviews, url, crawl, sort_oldest_first, retry_on_rate_limit, page_limit))
-        t.run()
+        job_id, _ = submit_job(url, options)
+        if job_id is None:
+            return Response("{'status_code': '503', 'message': 'too many jobs in the queue, try again later'}", status=503, mimetype='application/json')
         return {'fetch_results_at': '/result?job_id=%s' % (str(job_id))}
     abort(400)
 
 
+@app.route('/batch', methods=['POST'])
+def batch():
+    """Queue jobs for several URLs with the same crawl options, sharing one budget of concurrent page requests,
+    and return endpoints to retrieve the results at. URLs already being processed with the same options attach to existing jobs.
+    """
+    try:
+        parameters = request.get_json()
+    except werkzeug.exceptions.BadRequest:
+        return Response("{'status_code': '400', 'message': 'request parameters have not been provided'}", status=400, mimetype='application/json')
+
+    urls = parameters['urls'] if 'urls' in parameters else None
+    if not isinstance(urls, list) or not urls:
+        return Response("{'status_code': '400', 'message': 'remote URLs have not been provided'}", status=400, mimetype='application/json')
+
+    if not all(isinstance(url, str) and url.startswith('https://www.productreview.com.au/listings/') for url in urls):
+        return Response("{'status_code': '400', 'message': 'remote URL is invalid'}", status=400, mimetype='application/json')
+
+    options = parse_job_options(parameters)
+    budget = threading.BoundedSemaphore(max(1, min(options['concurrency'], MAX_CRAWL_CONCURRENCY)))
+    jobs = []
+    for url in urls:
+        job_id, coalesced = submit_job(url, options, budget)
+        if job_id is None:
+            jobs.append({'url': url, 'error': 'too many jobs in the queue, try again later'})
+        else:
+            jobs.append({'url': url, 'fetch_results_at': '/result?job_id=%s' % (str(job_id)), 'coalesced': coalesced})
+    if all('error' in job for job in jobs):
+        return Response("{'status_code': '503', 'message': 'too many jobs in the queue, try again later'}", status=503, mimetype='application/json')
+    return {'jobs': jobs}
+
+
 @app.route('/jobs', methods=['GET'])
 def result():
-    """Return list of async jobs"""
+    """Return list of async jobs, along with the state of the job queue"""
     global JOBS
-    return {'jobs': list(JOBS.keys())}
+    return {'jobs': list(JOBS.keys()), 'queue': SCHEDULER.status()}
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Return connection pool usage and page cache counters"""
+    return {'connections': connection_stats(), 'page_cache': PAGE_CACHE.stats()}
+
+
+def stream_job_result(job_id, cursor=0):
+    """Yield result of a job as NDJSON lines: job status, then one line per review, following a running job
+    until it is done, then job status again along with the cursor to resume from.
+
+    Args:
+        str job_id: ID of a job
+        int cursor: only reviews added after the one with this cursor are returned
+    """
+    header = JOBS.header(job_id)
+    yield json.dumps({'http_response': header['http_response'], 'job_status': header['job_status']}) + '\n'
+    while True:
+        try:
+            header = JOBS.header(job_id)
+        except KeyError:
+            logger.warning('Job %s is gone while streaming its results' % (job_id))
+            return
+        rows = JOBS.iter_reviews(job_id, after=cursor, limit=RESULT_PAGE_SIZE_MAX)
+        for cursor, url, review in rows:
+            yield json.dumps({'cursor': cursor, 'url': url, 'review': review}, ensure_ascii=False) + '\n'
+        if len(rows) == RESULT_PAGE_SIZE_MAX:
+            continue
+        if header['job_status'] not in PENDING_JOB_STATUSES:
+            break
+        time.sleep(RESULT_STREAM_POLL_INTERVAL)
+    yield json.dumps({'http_response': header['http_response'], 'job_status': header['job_status'], 'next_cursor': cursor}) + '\n'
+
+
+def job_progress(header):
+    """Return status and progress of a job, along with version identifying this state of the job.
+
+    Args:
+        dict header: job result without reviews
+    """
+    return {'http_response': header['http_response'], 'job_status': header['job_status'], 'progress': header.get('progress'), 'version': hashlib.sha1(dump_json(header)).hexdigest()[:16]}
+
+
+def wait_for_job_change(job_id, version=None, timeout=PROGRESS_WAIT):
+    """Return status and progress of a job as soon as its version differs from the specified one or the job is done,
+    or the current ones when timeout passes. Jobs run by other processes are noticed by checking the store periodically.
+
+    Args:
+        str job_id: ID of a job
+        str version: version of the job known to the client
+        float timeout: maximum number of seconds to wait
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        state = job_progress(JOBS.header(job_id))
+        remaining = deadline - time.monotonic()
+        if state['version'] != version or state['job_status'] not in PENDING_JOB_STATUSES or remaining <= 0:
+            return state
+        with JOB_EVENTS:
+            JOB_EVENTS.wait(min(remaining, RESULT_STREAM_POLL_INTERVAL))
+
+
+def stream_job_progress(job_id, version=None):
+    """Yield Server-Sent Events with status and progress of a job every time they change: 'progress' events while
+    the job runs, then 'done' event once it is done (comment lines are sent to keep the connection open meanwhile).
+
+    Args:
+        str job_id: ID of a job
+        str version: version of the job known to the client (e.g. from Last-Event-ID)
+    """
+    while True:
+        try:
+            state = wait_for_job_change(job_id, version)
+        except KeyError:
+            logger.warning('Job %s is gone while streaming its progress' % (job_id))
+            return
+        done = state['job_status'] not in PENDING_JOB_STATUSES
+        if state['version'] == version and not done:
+            yield ': waiting\n\n'
+            continue
+        version = state['version']
+        yield 'id: %s\nevent: %s\ndata: %s\n\n' % (version, 'done' if done else 'progress', json.dumps(state))
+        if done:
+            return
+
+
+@app.route('/progress', methods=['GET'])
+def progress_view():
+    """Return status and progress of a job, waiting until they change when version is specified (long polling),
+    or stream them as Server-Sent Events (when format=sse or the client accepts only text/event-stream)
+    """
+    job_id = request.args['job_id']
+    if job_id not in JOBS:
+        abort(400)
+    if request.args.get('format') == 'sse' or request.accept_mimetypes.best_match(['application/json', 'text/event-stream']) == 'text/event-stream':
+        version = request.headers.get('Last-Event-ID') or request.args.get('version')
+        return Response(stream_with_context(stream_job_progress(job_id, version)), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    timeout = float(request.args['timeout']) if request.args.get('timeout', '').replace('.', '', 1).isdigit() else PROGRESS_WAIT
+    try:
+        return wait_for_job_change(job_id, request.args.get('version'), max(0.0, min(timeout, PROGRESS_WAIT_MAX)) if 'version' in request.args else 0)
+    except KeyError:
+        abort(400)
+
+
+def changed_reviews(job_id, reviews, since=None, changed_only=False):
+    """Keep only reviews whose content was first seen after specified revision, and/or first seen by the job itself.
+    Versions of reviews edited since the job saw them are left out, reviews missing from the index are kept.
+
+    Args:
+        str job_id: ID of the job the reviews belong to
+        dict reviews: reviews by URL
+        int since: when specified, only reviews whose content was first seen after this revision are kept
+        bool changed_only: when True, only reviews that were new or edited when the job saw them are kept
+    """
+    entries = REVIEWS.lookup(reviews.keys())
+    kept = {}
+    for url, review in reviews.items():
+        if url in entries:
+            digest, revision, seen_by = entries[url]
+            if digest != store.review_digest(review) or (since is not None and revision <= since) or (changed_only and seen_by != job_id):
+                continue
+        kept[url] = review
+    return kept
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_view():
+    """Return metrics in Prometheus text format"""
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/result', methods=['GET'])
 def jobs():
-    """Return result of a job done asynchronously"""
+    """Return result of a job done asynchronously, either whole, page by page (when cursor or limit is specified),
+    or streamed as NDJSON (when format=ndjson). Whole results and pages can be narrowed down to reviews that changed
+    since a revision of the review index (since) or that were new or edited when the job saw them (changed_only).
+    """
     global JOBS
     job_id = request.args['job_id']
-    if job_id in JOBS:
-        return JOBS[job_id]
-    abort(400)
+    try:
+        header = JOBS.header(job_id)
+    except KeyError:
+        abort(400)
+    cursor = int(request.args['cursor']) if request.args.get('cursor', '').isdigit() else 0
+    since = int(request.args['since']) if request.args.get('since', '').isdigit() else None
+    changed_only = request.args.get('changed_only', '').lower() == 'true'
+    if request.args.get('format') == 'ndjson':
+        return Response(stream_with_context(stream_job_result(job_id, cursor)), mimetype='application/x-ndjson')
+    if 'cursor' in request.args or 'limit' in request.args:
+        limit = int(request.args['limit']) if request.args.get('limit', '').isdigit() else RESULT_PAGE_SIZE
+        limit = max(1, min(limit, RESULT_PAGE_SIZE_MAX))
+        revision = REVIEWS.latest()
+        rows = JOBS.iter_reviews(job_id, after=cursor, limit=limit)
+        header['data'] = {url: review for _, url, review in rows}
+        if since is not None or changed_only:
+            header['data'] = changed_reviews(job_id, header['data'], since, changed_only)
+            header['revision'] = revision
+        header['next_cursor'] = rows[-1][0] if rows else cursor
+        header['complete'] = header['job_status'] not in PENDING_JOB_STATUSES and len(rows) < limit
+        return header
+    try:
+        if since is not None or changed_only:
+            revision = REVIEWS.latest()
+            result = JOBS[job_id]
+            result['data'] = changed_reviews(job_id, result['data'], since, changed_only)
+            result['revision'] = revision
+            return SerializedResult(result).response()
+        if header['job_status'] in PENDING_JOB_STATUSES:
+            return SerializedResult(JOBS[job_id]).response()
+        return RESULT_CACHE.get(job_id, header, lambda: JOBS[job_id]).response()
+    except KeyError:
+        abort(400)
 
 
 if __name__ == '__main__':
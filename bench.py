@@ -0,0 +1,346 @@
+"""Offline benchmarks: a local stand-in for www.productreview.com.au serving synthetic listing pages,
+and runners measuring parse_html(), get_reviews_from_page() and full get_reviews() crawls against it.
+
+    python bench.py --reviews 2000 --distribution 5,5,10,80,1900 --latency 0.05 --concurrency 8
+"""
+import argparse
+import http.server
+import json
+import math
+import os
+import random
+import threading
+import time
+import tracemalloc
+import urllib.parse
+import uuid
+
+# keep jobs of the benchmarks in memory instead of the store shared with a locally running service
+os.environ['SCREVIEW_JOB_STORE'] = 'memory'
+import api
+import store
+
+PAGE_SIZE = 25
+
+
+def encode_ssr_data(value):
+    """Serialize value the way the remote embeds it into window.__ssr_data='...' (reverse of api.decode_rating_distribution)
+
+    Args:
+        object value: JSON-serializable value
+    """
+    return json.dumps(value).replace('\\', '\\\\').replace('"', '\\"').replace("'", "\\'")
+
+
+class SyntheticListing:
+    """Reviews of a synthetic listing, stratified by star rating, newest first"""
+
+    def __init__(self, name, rating_distribution):
+        """
+        Args:
+            str name: listing name (last part of listing URL)
+            list rating_distribution: number of reviews for each star rating, 1 to 5
+        """
+        self.name = name
+        self.rating_distribution = list(rating_distribution)
+        self.reviews = {}
+        published = 1650000000
+        for star_rating in range(5, 0, -1):
+            for i in range(self.rating_distribution[star_rating-1]):
+                review_id = uuid.uuid5(uuid.NAMESPACE_URL, '%s/%d/%d' % (name, star_rating, i))
+                published -= 3607
+                self.reviews.setdefault(star_rating, []).append({
+                    'url': 'https://www.productreview.com.au/reviews/%s' % (review_id),
+                    'headline': 'Review %d of %d stars for %s' % (i, star_rating, name),
+                    'reviewBody': 'Synthetic review body. ' * (5 + i % 20),
+                    'author': {'name': 'Author %d' % (i), 'sameAs': 'https://www.productreview.com.au/consumer-profiles/%s' % (uuid.uuid5(review_id, 'author'))},
+                    'reviewRating': {'ratingValue': star_rating},
+                    'datePublished': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(published)),
+                })
+
+    def select(self, star_rating=None, page_number=1, sort_by_oldest=False):
+        """Return reviews shown on requested page.
+
+        Args:
+            int star_rating: only reviews with this rating are shown (all reviews if None)
+            int page_number: page number
+            bool sort_by_oldest: when True, reviews are sorted 'oldest to newest'
+        """
+        if star_rating is None:
+            reviews = sorted((review for bucket in self.reviews.values() for review in bucket), key=lambda review: review['datePublished'], reverse=True)
+        else:
+            reviews = list(self.reviews.get(star_rating, []))
+        if sort_by_oldest:
+            reviews.reverse()
+        return reviews[(page_number-1)*PAGE_SIZE:page_number*PAGE_SIZE]
+
+    def render(self, star_rating=None, page_number=1, sort_by_oldest=False, padding=0):
+        """Return HTML page shaped like the listing pages of the remote.
+
+        Args:
+            int star_rating: only reviews with this rating are shown (all reviews if None)
+            int page_number: page number
+            bool sort_by_oldest: when True, reviews are sorted 'oldest to newest'
+            int padding: approximate number of filler bytes added to the page (the remote's pages carry ~100-700 KB of markup and state)
+        """
+        content = {
+            '@context': 'http://schema.org',
+            '@type': 'LocalBusiness',
+            'name': self.name,
+            'aggregateRating': {'@type': 'AggregateRating', 'ratingValue': 4.5, 'reviewCount': sum(self.rating_distribution)},
+            'review': [dict(review, **{'@type': 'Review'}) for review in self.select(star_rating, page_number, sort_by_oldest)],
+        }
+        ssr_data = {
+            'config': {'env': 'benchmark', 'filler': 'x' * (padding // 2)},
+            'reduxAsyncConnect': {'itemsMap': {'listingPageAsyncDataContainer': {'data': {'listing': {'statistics': {'ratingDistribution': self.rating_distribution}}}}}},
+        }
+        return ''.join([
+            '<!DOCTYPE html><html lang="en-AU"><head>',
+            '<title data-react-helmet="true">%s | ProductReview.com.au</title>' % (self.name),
+            '<meta data-react-helmet="true" charSet="utf-8"/>',
+            '<script data-react-helmet="true" type="application/ld+json">%s</script>' % (json.dumps(content)),
+            '</head><body>',
+            '<div class="filler">%s</div>' % ('<span>synthetic markup</span>' * (padding // 58)),
+            '<script>window.__ssr_data=\'%s\';</script>' % (encode_ssr_data(ssr_data)),
+            '</body></html>',
+        ])
+
+
+class ListingRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Serve /listings/<name> pages of the synthetic listings held by the server"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        if server.latency > 0:
+            time.sleep(server.latency)
+        roll = server.random()
+        if roll < server.rate_429:
+            return self.reply(429, b'Too many requests', {'Retry-After': str(server.retry_after)})
+        if roll < server.rate_429 + server.rate_503:
+            return self.reply(503, b'<html><body>Checking your browser</body></html>')
+        parts = urllib.parse.urlsplit(self.path)
+        name = parts.path.rstrip('/').split('/')[-1]
+        if not parts.path.startswith('/listings/') or name not in server.listings:
+            return self.reply(404, b'Not found')
+        query = urllib.parse.parse_qs(parts.query)
+        star_rating = int(query['rating'][0]) if 'rating' in query else None
+        page_number = int(query['page'][0]) if 'page' in query else 1
+        sort_by_oldest = query.get('sortBy') == ['oldest']
+        html = server.listings[name].render(star_rating, page_number, sort_by_oldest, server.padding)
+        self.reply(200, html.encode('utf8'), {'Content-Type': 'text/html; charset=utf-8'})
+
+    def reply(self, status_code, body, headers=None):
+        self.send_response(status_code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ListingServer(http.server.ThreadingHTTPServer):
+    """Local HTTP server standing in for www.productreview.com.au"""
+
+    daemon_threads = True
+
+    def __init__(self, listings, latency=0.0, rate_429=0.0, rate_503=0.0, retry_after=1, padding=100000, seed=0, port=0):
+        """
+        Args:
+            list listings: SyntheticListing objects to serve
+            float latency: seconds to wait before answering each request
+            float rate_429: share of requests answered with status code 429
+            float rate_503: share of requests answered with status code 503 (challenge)
+            int retry_after: value of Retry-After header sent with 429
+            int padding: approximate number of filler bytes added to each page
+            int seed: seed for the random choice of failing requests
+            int port: port to listen on (any free port if 0)
+        """
+        super().__init__(('127.0.0.1', port), ListingRequestHandler)
+        self.listings = {listing.name: listing for listing in listings}
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.rate_503 = rate_503
+        self.retry_after = retry_after
+        self.padding = padding
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+
+    def random(self):
+        with self.rng_lock:
+            return self.rng.random()
+
+    def listing_url(self, name):
+        """Return URL of a listing served by this server"""
+        return 'http://127.0.0.1:%d/listings/%s' % (self.server_address[1], name)
+
+    def start(self):
+        """Serve requests in a background thread"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def prepare_client(server):
+    """Point the crawler at the local server: no rate limiting towards it, no page cache between runs"""
+    api.HOST_LIMITERS['127.0.0.1:%d' % (server.server_address[1])] = api.TokenBucket(rate=1000000, burst=1000000)
+    api.PAGE_CACHE = api.PageCache(size=0)
+
+
+def percentile(values, share):
+    """Return value below which the specified share of values falls (nearest rank)"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, math.ceil(share * len(values)) - 1)]
+
+
+def report(name, wall_time, cpu_time, latencies, pages, reviews, peak_memory):
+    """Print one line of benchmark results"""
+    print('%-22s pages=%-6d pages/s=%-9.1f reviews/s=%-10.1f p50=%-8.2fms p99=%-8.2fms cpu/page=%-8.2fms peak_mem=%.1fMB' % (
+        name, pages, pages / wall_time if wall_time else 0, reviews / wall_time if wall_time else 0,
+        percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000, cpu_time / pages * 1000 if pages else 0, peak_memory / 1048576))
+
+
+def measure(name, run, count):
+    """Call run() count times (it returns number of reviews processed), and report timings"""
+    latencies, reviews = [], 0
+    tracemalloc.start()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    for _ in range(count):
+        started = time.perf_counter()
+        reviews += run()
+        latencies.append(time.perf_counter() - started)
+    wall_time, cpu_time = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    report(name, wall_time, cpu_time, latencies, count, reviews, peak_memory)
+
+
+def bench_parse_html(listing, padding, count):
+    html = listing.render(padding=padding)
+    measure('parse_html', lambda: len(api.parse_html(html, True, 'benchmark', 'Completed, status code 200')[4]), count)
+
+
+def bench_parse_pool(listing, padding, count):
+    body = listing.render(padding=padding).encode('utf8')
+    latencies = []
+    tracemalloc.start()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    futures = [(time.perf_counter(), api.PARSE_POOL.submit(api.parse_body, body, 'utf8', True, 'benchmark', 'Completed, status code 200')) for _ in range(count)]
+    reviews = 0
+    for started, future in futures:
+        reviews += len(future.result()[4])
+        latencies.append(time.perf_counter() - started)
+    wall_time, cpu_time = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    report('parse_pool', wall_time, cpu_time, latencies, count, reviews, peak_memory)
+
+
+def bench_job_store_memory(listing):
+    """Compare memory taken by reviews of the listing held as plain dicts and held by in-memory job store"""
+    serialized = json.dumps({review['url']: {'title': review['headline'], 'content': review['reviewBody'], 'author_name': review['author']['name'], 'author_uri': review['author']['sameAs'], 'rating': review['reviewRating']['ratingValue'], 'date': review['datePublished']}
+                             for bucket in listing.reviews.values() for review in bucket})
+    tracemalloc.start()
+    plain = json.loads(serialized)
+    plain_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del plain
+    tracemalloc.start()
+    job_store = store.MemoryJobStore()
+    job_store.append_reviews('benchmark', json.loads(serialized))
+    compact_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('%-22s reviews=%-6d plain=%.1fMB compact=%.1fMB (%.0f%% less)' % (
+        'job_store_memory', sum(listing.rating_distribution), plain_size / 1048576, compact_size / 1048576, 100 - compact_size * 100 / plain_size if plain_size else 0))
+
+
+def bench_get_reviews_from_page(server, listing, count):
+    url = server.listing_url(listing.name)
+    measure('get_reviews_from_page', lambda: len(api.get_reviews_from_page(url, True, get_ssr_data=True)[4]), count)
+
+
+def bench_get_reviews(server, listing, concurrency):
+    url = server.listing_url(listing.name)
+    latencies = []
+    # pages are timed where the crawl engine in use requests them
+    owner = api.ASYNC_ENGINE if api.ASYNC_ENGINE is not None else api
+    get_reviews_from_page = owner.get_reviews_from_page
+
+    def timed_get_reviews_from_page(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return get_reviews_from_page(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    async def timed_get_reviews_from_page_async(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await get_reviews_from_page(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    owner.get_reviews_from_page = timed_get_reviews_from_page_async if owner is api.ASYNC_ENGINE else timed_get_reviews_from_page
+    try:
+        tracemalloc.start()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        result = api.get_reviews(url, crawl=True, retry_on_rate_limit=True, concurrency=concurrency)
+        wall_time, cpu_time = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        if owner is api:
+            api.get_reviews_from_page = get_reviews_from_page
+        else:
+            del owner.get_reviews_from_page
+    report('get_reviews(c=%d)' % (concurrency), wall_time, cpu_time, latencies, len(latencies), len(result['data']), peak_memory)
+    if len(result['data']) != sum(listing.rating_distribution):
+        print('  collected %d of %d reviews' % (len(result['data']), sum(listing.rating_distribution)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parsing and crawling against a local stand-in for www.productreview.com.au')
+    parser.add_argument('--reviews', type=int, default=1000, help='number of reviews of the synthetic listing (ignored if --distribution is given)')
+    parser.add_argument('--distribution', default=None, help='comma-separated number of reviews for star ratings 1 to 5')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds the server waits before answering')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--rate-503', type=float, default=0.0, help='share of requests answered with 503')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After sent with 429')
+    parser.add_argument('--page-size', type=int, default=300000, help='approximate size of a page in bytes')
+    parser.add_argument('--concurrency', default='1,4,16', help='comma-separated concurrency levels for full crawls')
+    parser.add_argument('--repeat', type=int, default=50, help='number of pages for single-page benchmarks')
+    parser.add_argument('--parse-workers', type=int, default=0, help='number of processes parsing pages (0 to parse in the requesting thread)')
+    args = parser.parse_args()
+
+    api.logger.root.setLevel('WARNING')
+    if args.parse_workers > 0:
+        api.PARSE_POOL = api.create_parse_pool(args.parse_workers)
+    if args.distribution:
+        rating_distribution = [int(x) for x in args.distribution.split(',')]
+    else:
+        rating_distribution = [args.reviews * share // 100 for share in (3, 2, 5, 15)]
+        rating_distribution.append(args.reviews - sum(rating_distribution))
+    listing = SyntheticListing('benchmark-listing', rating_distribution)
+    server = ListingServer([listing], latency=args.latency, rate_429=args.rate_429, rate_503=args.rate_503, retry_after=args.retry_after, padding=args.page_size).start()
+    prepare_client(server)
+    print('listing: %d reviews %s, page size ~%d KB, latency %.0f ms, 429 rate %.2f, 503 rate %.2f' % (
+        sum(rating_distribution), rating_distribution, len(listing.render(padding=args.page_size)) // 1024, args.latency * 1000, args.rate_429, args.rate_503))
+    bench_parse_html(listing, args.page_size, args.repeat)
+    if api.PARSE_POOL is not None:
+        bench_parse_pool(listing, args.page_size, args.repeat)
+    bench_get_reviews_from_page(server, listing, args.repeat)
+    bench_job_store_memory(listing)
+    for concurrency in args.concurrency.split(','):
+        bench_get_reviews(server, listing, int(concurrency))
+    server.shutdown()
+    if api.ASYNC_ENGINE is not None:
+        api.ASYNC_ENGINE.close()
+
+
+if __name__ == '__main__':
+    main()
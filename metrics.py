@@ -0,0 +1,172 @@
+import bisect
+import contextlib
+import threading
+import time
+
+# upper bounds of histogram buckets, in seconds, used for stage latencies
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def format_labels(names, values, extra=()):
+    """Render label set in Prometheus text format, e.g. {stage="fetch"}"""
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % (','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs))
+
+
+def format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """Base for metrics kept in memory of the current process and exposed in Prometheus text format"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=(), callback=None):
+        """
+        Args:
+            str name: metric name
+            str documentation: help text
+            tuple labels: names of labels the metric is broken down by
+            object callback: when specified, called on render and expected to return current value (metric without labels only)
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.callback = callback
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError('%s expects labels %s, got %s' % (self.name, self.labels, tuple(labels)))
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self):
+        """Return list of (name suffix, label values, extra labels, value)"""
+        if self.callback is not None:
+            return [('', (), (), self.callback())]
+        with self.lock:
+            return [('', key, (), value) for key, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.kind)]
+        for suffix, key, extra, value in self.samples():
+            lines.append('%s%s%s %s' % (self.name, suffix, format_labels(self.labels, key, extra), format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Value that only goes up, either incremented explicitly or read from a callback (for totals kept by another component) when rendered"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self.key(labels), 0)
+
+
+class Gauge(Metric):
+    """Value that goes up and down, either set explicitly or read from a callback when rendered"""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets, along with their sum and count"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            str name: metric name
+            str documentation: help text
+            tuple labels: names of labels the metric is broken down by
+            tuple buckets: upper bounds of buckets, ascending
+        """
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self.local = threading.local()
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        recorded = getattr(self.local, 'recorded', None)
+        if recorded is not None:
+            recorded.append((labels, value))
+            return
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            series = self.values[key]
+            series['counts'][bisect.bisect_left(self.buckets, value)] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe number of seconds spent in the with-block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    @contextlib.contextmanager
+    def recording(self):
+        """Collect list of (labels, value) observed by the current thread in the with-block instead of adding them to the histogram,
+        so they can be handed over to the process that exposes metrics
+        """
+        self.local.recorded = recorded = []
+        try:
+            yield recorded
+        finally:
+            self.local.recorded = None
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, series in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), series['counts']):
+                    cumulative += count
+                    samples.append(('_bucket', key, (('le', '+Inf' if bound == float('inf') else format_value(bound)),), cumulative))
+                samples.append(('_sum', key, (), series['sum']))
+                samples.append(('_count', key, (), series['count']))
+        return samples
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self):
+        """Return all metrics in Prometheus text exposition format"""
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
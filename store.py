@@ -0,0 +1,618 @@
+import calendar
+import collections
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# jobs not updated for this many seconds are evicted, as well as the oldest jobs beyond this count
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_JOBS = 1000
+
+# reviews kept in the review index, the ones whose content was first seen longest ago are dropped first
+DEFAULT_MAX_INDEXED_REVIEWS = 200000
+
+
+# prefixes of review URLs and author profile URLs, kept once instead of in every review held in memory
+REVIEW_URL_PREFIX = 'https://www.productreview.com.au/reviews/'
+AUTHOR_URI_PREFIX = 'https://www.productreview.com.au/consumer-profiles/'
+
+# format of review dates, held in memory as timestamps
+REVIEW_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# fields of a review as returned by the API
+REVIEW_FIELDS = ('title', 'content', 'author_name', 'author_uri', 'rating', 'date')
+
+
+def compact_url(url, prefix):
+    """Reduce URL made of prefix and UUID to the 16 bytes of the UUID (other URLs are returned as they are).
+
+    Args:
+        str url: URL to reduce
+        str prefix: prefix the UUID follows
+    """
+    if isinstance(url, str) and url.startswith(prefix):
+        try:
+            value = uuid.UUID(url[len(prefix):])
+        except ValueError:
+            return url
+        if str(value) == url[len(prefix):]:
+            return value.bytes
+    return url
+
+
+def expand_url(value, prefix):
+    """Restore URL reduced with compact_url().
+
+    Args:
+        object value: UUID bytes or URL
+        str prefix: prefix the UUID follows
+    """
+    return prefix + str(uuid.UUID(bytes=value)) if isinstance(value, bytes) else value
+
+
+def compact_date(date):
+    """Parse review date into timestamp (dates in other formats are returned as they are).
+
+    Args:
+        str date: date in REVIEW_DATE_FORMAT
+    """
+    try:
+        timestamp = calendar.timegm(time.strptime(date, REVIEW_DATE_FORMAT))
+    except (TypeError, ValueError):
+        return date
+    return timestamp if time.strftime(REVIEW_DATE_FORMAT, time.gmtime(timestamp)) == date else date
+
+
+def expand_date(value):
+    """Restore review date parsed with compact_date().
+
+    Args:
+        object value: timestamp or date
+    """
+    return time.strftime(REVIEW_DATE_FORMAT, time.gmtime(value)) if isinstance(value, int) else value
+
+
+class CompactReview:
+    """Review held in memory with its URLs reduced to UUID bytes and its date parsed into timestamp"""
+
+    __slots__ = ('title', 'content', 'author_name', 'author', 'rating', 'date')
+
+    def __init__(self, review):
+        """
+        Args:
+            dict review: review as returned by the API
+        """
+        self.title = review['title']
+        self.content = review['content']
+        self.author_name = review['author_name']
+        self.author = compact_url(review['author_uri'], AUTHOR_URI_PREFIX)
+        self.rating = review['rating']
+        self.date = compact_date(review['date'])
+
+    def expand(self):
+        """Return review as returned by the API"""
+        return {'title': self.title, 'content': self.content, 'author_name': self.author_name, 'author_uri': expand_url(self.author, AUTHOR_URI_PREFIX), 'rating': self.rating, 'date': expand_date(self.date)}
+
+
+def compact_review(review):
+    """Return compact form of a review to hold in memory (values that don't have the shape of a review are returned as they are).
+
+    Args:
+        dict review: review as returned by the API
+    """
+    if isinstance(review, dict) and len(review) == len(REVIEW_FIELDS) and all(field in review for field in REVIEW_FIELDS):
+        return CompactReview(review)
+    return review
+
+
+def expand_review(value):
+    """Restore review held in compact form.
+
+    Args:
+        object value: CompactReview or review as it was stored
+    """
+    return value.expand() if isinstance(value, CompactReview) else value
+
+
+def encode(value):
+    """Serialize value as compact zlib-compressed JSON.
+
+    Args:
+        object value: JSON-serializable value
+    """
+    return zlib.compress(json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf8'))
+
+
+def decode(body):
+    """Restore value serialized with encode().
+
+    Args:
+        bytes body: compressed JSON
+    """
+    return json.loads(zlib.decompress(body).decode('utf8'))
+
+
+def review_digest(review):
+    """Return short hash of review content, used to tell whether a known review has been edited.
+
+    Args:
+        dict review: review as extracted by parse_html()
+    """
+    return hashlib.sha1(json.dumps(review, sort_keys=True, ensure_ascii=False).encode('utf8')).hexdigest()[:16]
+
+
+def split_result(result):
+    """Split job result into header (result with empty data) and reviews, so reviews can be stored and paged one by one.
+    Results that don't hold reviews are returned as header as they are, with reviews set to None.
+
+    Args:
+        object result: job result
+    """
+    if isinstance(result, dict) and isinstance(result.get('data'), dict):
+        header = dict(result)
+        header['data'] = {}
+        return header, result['data']
+    return result, None
+
+
+class MemoryJobStore:
+    """Job store keeping job results in memory of the current process (results are lost on restart).
+    Reviews are held in compact form, keyed by the UUIDs of their URLs, and restored when read.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_jobs=DEFAULT_MAX_JOBS):
+        """
+        Args:
+            int ttl: number of seconds a job is kept after it was last updated
+            int max_jobs: maximum number of jobs kept, oldest ones are evicted first
+        """
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.jobs = collections.OrderedDict()
+        self.reviews = {}
+        self.cursor = 0
+        self.lock = threading.Lock()
+
+    def evict(self):
+        """Drop jobs that expired or don't fit the store"""
+        with self.lock:
+            expired_before = time.time() - self.ttl
+            while self.jobs and (len(self.jobs) > self.max_jobs or next(iter(self.jobs.values()))[0] < expired_before):
+                job_id, _ = self.jobs.popitem(last=False)
+                self.reviews.pop(job_id, None)
+
+    def append_reviews(self, job_id, reviews):
+        """Add reviews to the result of a job (reviews already stored for the job are updated in place).
+
+        Args:
+            str job_id: ID of a job
+            dict reviews: reviews by URL
+        """
+        with self.lock:
+            job_reviews = self.reviews.setdefault(job_id, {})
+            for url, review in reviews.items():
+                key = compact_url(url, REVIEW_URL_PREFIX)
+                if key in job_reviews:
+                    job_reviews[key] = (job_reviews[key][0], compact_review(review))
+                else:
+                    self.cursor += 1
+                    job_reviews[key] = (self.cursor, compact_review(review))
+
+    def __setitem__(self, job_id, result):
+        header, reviews = split_result(result)
+        with self.lock:
+            self.jobs.pop(job_id, None)
+            self.jobs[job_id] = (time.time(), encode(header))
+            if not reviews:
+                self.reviews.pop(job_id, None)
+            elif job_id in self.reviews:
+                for key in set(self.reviews[job_id]) - set(compact_url(url, REVIEW_URL_PREFIX) for url in reviews):
+                    del self.reviews[job_id][key]
+        if reviews:
+            self.append_reviews(job_id, reviews)
+        self.evict()
+
+    def update_header(self, job_id, values):
+        """Set fields of job result other than reviews, keeping reviews stored for the job.
+
+        Args:
+            str job_id: ID of a job
+            dict values: fields to set
+        """
+        with self.lock:
+            _, body = self.jobs.pop(job_id)
+            header = decode(body)
+            header.update(values)
+            self.jobs[job_id] = (time.time(), encode(header))
+
+    def header(self, job_id):
+        """Return job result without reviews.
+
+        Args:
+            str job_id: ID of a job
+        """
+        with self.lock:
+            updated, body = self.jobs[job_id]
+        if updated < time.time() - self.ttl:
+            raise KeyError(job_id)
+        return decode(body)
+
+    def iter_reviews(self, job_id, after=0, limit=None):
+        """Return list of (cursor, url, review) stored for a job, in the order they were added.
+
+        Args:
+            str job_id: ID of a job
+            int after: only reviews added after the one with this cursor are returned
+            int limit: maximum number of reviews to return
+        """
+        with self.lock:
+            rows = sorted((cursor, key, review) for key, (cursor, review) in self.reviews.get(job_id, {}).items() if cursor > after)
+        if limit is not None:
+            rows = rows[:limit]
+        return [(cursor, expand_url(key, REVIEW_URL_PREFIX), expand_review(review)) for cursor, key, review in rows]
+
+    def __getitem__(self, job_id):
+        result = self.header(job_id)
+        if isinstance(result, dict) and isinstance(result.get('data'), dict):
+            result['data'].update((url, review) for _, url, review in self.iter_reviews(job_id))
+        return result
+
+    def __delitem__(self, job_id):
+        with self.lock:
+            del self.jobs[job_id]
+            self.reviews.pop(job_id, None)
+
+    def __contains__(self, job_id):
+        try:
+            self.header(job_id)
+        except KeyError:
+            return False
+        return True
+
+    def keys(self):
+        self.evict()
+        with self.lock:
+            return list(self.jobs.keys())
+
+
+class SqliteStore:
+    """Base for stores kept in a local SQLite database, so data survives restarts
+    and several processes (e.g. gunicorn workers) can share it.
+    """
+
+    # number of keys looked up with one query
+    LOOKUP_CHUNK = 500
+
+    def __init__(self, path):
+        """
+        Args:
+            str path: path to database file (created if missing)
+        """
+        self.path = path
+        self.local = threading.local()
+
+    def connection(self):
+        """Return connection to the database opened by current thread"""
+        if getattr(self.local, 'connection', None) is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self.local.connection = connection
+        return self.local.connection
+
+
+class SqliteJobStore(SqliteStore):
+    """Job store keeping job results in a local SQLite database, so results survive restarts
+    and several processes (e.g. gunicorn workers) can serve the same job IDs.
+    Reviews are kept one per row, so they can be added while the job runs and read page by page. Rows of a job refer to
+    review bodies by review URL and content hash, so jobs that saw the same content of a review share one compressed copy of it.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_jobs=DEFAULT_MAX_JOBS):
+        """
+        Args:
+            str path: path to database file (created if missing)
+            int ttl: number of seconds a job is kept after it was last updated
+            int max_jobs: maximum number of jobs kept, oldest ones are evicted first
+        """
+        super().__init__(path)
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        with self.connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, created REAL NOT NULL, updated REAL NOT NULL, body BLOB NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (updated)')
+            connection.execute('CREATE TABLE IF NOT EXISTS review_bodies (url TEXT NOT NULL, digest TEXT NOT NULL, body BLOB NOT NULL, PRIMARY KEY (url, digest)) WITHOUT ROWID')
+            connection.execute('CREATE TABLE IF NOT EXISTS job_reviews (cursor INTEGER PRIMARY KEY, job_id TEXT NOT NULL, url TEXT NOT NULL, digest TEXT NOT NULL, UNIQUE (job_id, url))')
+            connection.execute('CREATE INDEX IF NOT EXISTS job_reviews_cursor ON job_reviews (job_id, cursor)')
+            connection.execute('CREATE INDEX IF NOT EXISTS job_reviews_body ON job_reviews (url, digest)')
+
+    def evict(self):
+        """Drop jobs that expired or don't fit the store"""
+        with self.connection() as connection:
+            evicted = [row[0] for row in connection.execute('SELECT job_id FROM jobs WHERE updated < ? OR job_id NOT IN (SELECT job_id FROM jobs ORDER BY updated DESC LIMIT ?)', (time.time() - self.ttl, self.max_jobs))]
+            connection.executemany('DELETE FROM jobs WHERE job_id = ?', ((job_id,) for job_id in evicted))
+            for job_id in evicted:
+                self._drop_reviews(connection, job_id)
+
+    @staticmethod
+    def _release(connection, refs):
+        """Delete review bodies no job refers to anymore, out of those specified as (url, digest)"""
+        connection.executemany('DELETE FROM review_bodies WHERE url = ? AND digest = ? AND NOT EXISTS (SELECT 1 FROM job_reviews WHERE url = ? AND digest = ?)', ((url, digest, url, digest) for url, digest in refs))
+
+    def _drop_reviews(self, connection, job_id):
+        # reviews are deleted by job ID through the (job_id, cursor) index rather than by scanning all review rows
+        refs = connection.execute('SELECT url, digest FROM job_reviews WHERE job_id = ?', (job_id,)).fetchall()
+        connection.execute('DELETE FROM job_reviews WHERE job_id = ?', (job_id,))
+        self._release(connection, refs)
+
+    def _upsert_reviews(self, connection, job_id, reviews):
+        digests = {url: review_digest(review) for url, review in reviews.items()}
+        urls = list(digests)
+        previous = {}
+        for start in range(0, len(urls), self.LOOKUP_CHUNK):
+            chunk = urls[start:start+self.LOOKUP_CHUNK]
+            previous.update(connection.execute('SELECT url, digest FROM job_reviews WHERE job_id = ? AND url IN (%s)' % (','.join('?' * len(chunk))), [job_id] + chunk))
+        connection.executemany('INSERT OR IGNORE INTO review_bodies (url, digest, body) VALUES (?, ?, ?)', ((url, digests[url], encode(review)) for url, review in reviews.items() if previous.get(url) != digests[url]))
+        connection.executemany('INSERT INTO job_reviews (job_id, url, digest) VALUES (?, ?, ?) ON CONFLICT(job_id, url) DO UPDATE SET digest=excluded.digest', ((job_id, url, digest) for url, digest in digests.items()))
+        self._release(connection, [(url, digest) for url, digest in previous.items() if digests[url] != digest])
+
+    def append_reviews(self, job_id, reviews):
+        """Add reviews to the result of a job (reviews already stored for the job are updated in place).
+
+        Args:
+            str job_id: ID of a job
+            dict reviews: reviews by URL
+        """
+        with self.connection() as connection:
+            self._upsert_reviews(connection, job_id, reviews)
+
+    def __setitem__(self, job_id, result):
+        header, reviews = split_result(result)
+        now = time.time()
+        with self.connection() as connection:
+            if not reviews:
+                self._drop_reviews(connection, job_id)
+            else:
+                stale = [(url, digest) for url, digest in connection.execute('SELECT url, digest FROM job_reviews WHERE job_id = ?', (job_id,)) if url not in reviews]
+                connection.executemany('DELETE FROM job_reviews WHERE job_id = ? AND url = ?', ((job_id, url) for url, _ in stale))
+                self._release(connection, stale)
+                self._upsert_reviews(connection, job_id, reviews)
+            connection.execute('INSERT INTO jobs (job_id, created, updated, body) VALUES (?, ?, ?, ?) ON CONFLICT(job_id) DO UPDATE SET updated=excluded.updated, body=excluded.body', (job_id, now, now, encode(header)))
+        self.evict()
+
+    def update_header(self, job_id, values):
+        """Set fields of job result other than reviews, keeping reviews stored for the job.
+
+        Args:
+            str job_id: ID of a job
+            dict values: fields to set
+        """
+        with self.connection() as connection:
+            row = connection.execute('SELECT body FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+            if row is None:
+                raise KeyError(job_id)
+            header = decode(row[0])
+            header.update(values)
+            connection.execute('UPDATE jobs SET updated = ?, body = ? WHERE job_id = ?', (time.time(), encode(header), job_id))
+
+    def header(self, job_id):
+        """Return job result without reviews.
+
+        Args:
+            str job_id: ID of a job
+        """
+        row = self.connection().execute('SELECT body FROM jobs WHERE job_id = ? AND updated >= ?', (job_id, time.time() - self.ttl)).fetchone()
+        if row is None:
+            raise KeyError(job_id)
+        return decode(row[0])
+
+    def iter_reviews(self, job_id, after=0, limit=None):
+        """Return list of (cursor, url, review) stored for a job, in the order they were added.
+
+        Args:
+            str job_id: ID of a job
+            int after: only reviews added after the one with this cursor are returned
+            int limit: maximum number of reviews to return
+        """
+        rows = self.connection().execute('SELECT job_reviews.cursor, job_reviews.url, review_bodies.body FROM job_reviews JOIN review_bodies ON review_bodies.url = job_reviews.url AND review_bodies.digest = job_reviews.digest '
+                                         'WHERE job_reviews.job_id = ? AND job_reviews.cursor > ? ORDER BY job_reviews.cursor LIMIT ?', (job_id, after, -1 if limit is None else limit))
+        return [(cursor, url, decode(body)) for cursor, url, body in rows]
+
+    def __getitem__(self, job_id):
+        result = self.header(job_id)
+        if isinstance(result, dict) and isinstance(result.get('data'), dict):
+            result['data'].update((url, review) for _, url, review in self.iter_reviews(job_id))
+        return result
+
+    def __delitem__(self, job_id):
+        with self.connection() as connection:
+            if connection.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,)).rowcount == 0:
+                raise KeyError(job_id)
+            self._drop_reviews(connection, job_id)
+
+    def __contains__(self, job_id):
+        return self.connection().execute('SELECT 1 FROM jobs WHERE job_id = ? AND updated >= ?', (job_id, time.time() - self.ttl)).fetchone() is not None
+
+    def keys(self):
+        return [row[0] for row in self.connection().execute('SELECT job_id FROM jobs WHERE updated >= ? ORDER BY created', (time.time() - self.ttl,))]
+
+
+class SqliteListingStore(SqliteStore):
+    """Store keeping state of previously crawled listings (by base URL) in a local SQLite database"""
+
+    def __init__(self, path):
+        """
+        Args:
+            str path: path to database file (created if missing)
+        """
+        super().__init__(path)
+        with self.connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS listings (base_url TEXT PRIMARY KEY, updated REAL NOT NULL, body BLOB NOT NULL)')
+
+    def __setitem__(self, base_url, state):
+        with self.connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO listings (base_url, updated, body) VALUES (?, ?, ?)', (base_url, time.time(), encode(state)))
+
+    def __getitem__(self, base_url):
+        row = self.connection().execute('SELECT body FROM listings WHERE base_url = ?', (base_url,)).fetchone()
+        if row is None:
+            raise KeyError(base_url)
+        return decode(row[0])
+
+    def __contains__(self, base_url):
+        return self.connection().execute('SELECT 1 FROM listings WHERE base_url = ?', (base_url,)).fetchone() is not None
+
+    def get(self, base_url, default=None):
+        try:
+            return self[base_url]
+        except KeyError:
+            return default
+
+
+class MemoryReviewIndex:
+    """Index of reviews seen by any job, keeping in memory of the current process the hash of each review's content,
+    the revision at which that content was first seen (revisions increase with every new or edited review) and the job that saw it
+    """
+
+    def __init__(self, max_reviews=DEFAULT_MAX_INDEXED_REVIEWS):
+        """
+        Args:
+            int max_reviews: maximum number of reviews kept, the ones with the oldest revisions are dropped first
+        """
+        self.max_reviews = max_reviews
+        self.reviews = collections.OrderedDict()
+        self.revision = 0
+        self.lock = threading.Lock()
+
+    def record(self, job_id, reviews):
+        """Add reviews seen by a job, giving new revision to reviews that are new or edited.
+
+        Args:
+            str job_id: ID of the job that saw the reviews
+            dict reviews: reviews by URL
+        """
+        with self.lock:
+            for url, review in reviews.items():
+                digest = review_digest(review)
+                if url not in self.reviews or self.reviews[url][0] != digest:
+                    self.revision += 1
+                    self.reviews.pop(url, None)
+                    self.reviews[url] = (digest, self.revision, job_id)
+            while len(self.reviews) > self.max_reviews:
+                self.reviews.popitem(last=False)
+
+    def lookup(self, urls):
+        """Return dict of (digest, revision, job_id) by URL, for those of the URLs that are indexed.
+
+        Args:
+            iterable urls: review URLs
+        """
+        with self.lock:
+            return {url: self.reviews[url] for url in urls if url in self.reviews}
+
+    def latest(self):
+        """Return latest revision"""
+        with self.lock:
+            return self.revision
+
+
+class SqliteReviewIndex(SqliteStore):
+    """Index of reviews seen by any job, kept in a local SQLite database so it is shared across processes and survives restarts.
+    Holds the hash of each review's content, the revision at which that content was first seen and the job that saw it.
+    """
+
+    def __init__(self, path, max_reviews=DEFAULT_MAX_INDEXED_REVIEWS):
+        """
+        Args:
+            str path: path to database file (created if missing)
+            int max_reviews: maximum number of reviews kept, the ones with the oldest revisions are dropped first
+        """
+        super().__init__(path)
+        self.max_reviews = max_reviews
+        with self.connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS review_index (url TEXT PRIMARY KEY, digest TEXT NOT NULL, revision INTEGER NOT NULL, job_id TEXT NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS review_index_revision ON review_index (revision)')
+
+    def record(self, job_id, reviews):
+        """Add reviews seen by a job, giving new revision to reviews that are new or edited.
+
+        Args:
+            str job_id: ID of the job that saw the reviews
+            dict reviews: reviews by URL
+        """
+        digests = {url: review_digest(review) for url, review in reviews.items()}
+        connection = self.connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            known = self._lookup(connection, list(digests))
+            changed = [url for url, digest in digests.items() if url not in known or known[url][0] != digest]
+            if not changed:
+                return
+            revision = connection.execute('SELECT COALESCE(MAX(revision), 0) FROM review_index').fetchone()[0]
+            connection.executemany('INSERT INTO review_index (url, digest, revision, job_id) VALUES (?, ?, ?, ?) ON CONFLICT(url) DO UPDATE SET digest=excluded.digest, revision=excluded.revision, job_id=excluded.job_id',
+                                   ((url, digests[url], revision + i + 1, job_id) for i, url in enumerate(changed)))
+            # every row holds a distinct revision, so keeping the latest max_reviews revisions keeps at most max_reviews rows
+            connection.execute('DELETE FROM review_index WHERE revision <= ?', (revision + len(changed) - self.max_reviews,))
+
+    def _lookup(self, connection, urls):
+        found = {}
+        for start in range(0, len(urls), self.LOOKUP_CHUNK):
+            chunk = urls[start:start+self.LOOKUP_CHUNK]
+            rows = connection.execute('SELECT url, digest, revision, job_id FROM review_index WHERE url IN (%s)' % (','.join('?' * len(chunk))), chunk)
+            found.update((url, (digest, revision, job_id)) for url, digest, revision, job_id in rows)
+        return found
+
+    def lookup(self, urls):
+        """Return dict of (digest, revision, job_id) by URL, for those of the URLs that are indexed.
+
+        Args:
+            iterable urls: review URLs
+        """
+        return self._lookup(self.connection(), list(urls))
+
+    def latest(self):
+        """Return latest revision"""
+        return self.connection().execute('SELECT COALESCE(MAX(revision), 0) FROM review_index').fetchone()[0]
+
+
+def open_job_store(location, ttl=DEFAULT_TTL, max_jobs=DEFAULT_MAX_JOBS):
+    """Create job store for specified location.
+
+    Args:
+        str location: 'memory' to keep jobs in memory of the current process, otherwise path to SQLite database file
+        int ttl: number of seconds a job is kept after it was last updated
+        int max_jobs: maximum number of jobs kept, oldest ones are evicted first
+    """
+    if location == 'memory':
+        return MemoryJobStore(ttl=ttl, max_jobs=max_jobs)
+    logger.info('Keeping jobs in %s' % (location))
+    return SqliteJobStore(location, ttl=ttl, max_jobs=max_jobs)
+
+
+def open_listing_store(location):
+    """Create store for state of crawled listings at specified location.
+
+    Args:
+        str location: 'memory' to keep state in memory of the current process, otherwise path to SQLite database file
+    """
+    if location == 'memory':
+        return {}
+    return SqliteListingStore(location)
+
+
+def open_review_index(location, max_reviews=DEFAULT_MAX_INDEXED_REVIEWS):
+    """Create index of reviews seen by any job at specified location.
+
+    Args:
+        str location: 'memory' to keep the index in memory of the current process, otherwise path to SQLite database file
+        int max_reviews: maximum number of reviews kept, the ones with the oldest revisions are dropped first
+    """
+    if location == 'memory':
+        return MemoryReviewIndex(max_reviews=max_reviews)
+    return SqliteReviewIndex(location, max_reviews=max_reviews)
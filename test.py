@@ -1,5 +1,17 @@
+import os
+# keep jobs of the tests in memory instead of the store shared with a locally running service
+os.environ['SCREVIEW_JOB_STORE'] = 'memory'
 import api
+import bench
+import gzip
+import json
+import metrics
+import re
 import requests
+import store
+import tempfile
+import threading
+import time
 from bs4 import BeautifulSoup
 from mock import patch
 import unittest
@@ -10,15 +22,32 @@ class TestApi(unittest.TestCase):
         pass
 
     def test_try_get_request(self):
-        with patch('requests.get') as patched_get:
+        with patch.object(api.SESSION, 'get') as patched_get:
             result = api.try_get_request('some_url', False)
-            patched_get.assert_called_with('some_url')
+            patched_get.assert_called_with('some_url', headers=None, timeout=api.HTTP_TIMEOUT)
             assert type(result) == tuple
             assert len(result) == 3
             assert type(result[0]) == bool
             assert type(result[1]) == str
             assert type(result[2]) == requests.Response or result[2] is None
     
+    def test_get_reviews_from_page_rate_limited(self):
+        with open('./testdata/reviews_present_1.html', mode='rb') as f:
+            body = f.read()
+        response = requests.Response()
+        response.status_code, response._content, response.encoding = 200, body, 'utf8'
+        limited = requests.Response()
+        limited.status_code, limited._content, limited.headers['Retry-After'] = 429, b'', '1'
+        api.HOST_LIMITERS['first.page'] = api.TokenBucket(rate=100, burst=10)
+        with patch.object(api.SESSION, 'get', side_effect=[limited, response]) as patched_get, patch('api.PAGE_CACHE', api.PageCache(size=0)):
+            started = time.monotonic()
+            result = api.get_reviews_from_page('https://first.page/listing', True, get_ssr_data=True)
+            # turned down page is sent again once the host's pause is over, the calling thread waits for it
+            assert patched_get.call_count == 2
+            assert time.monotonic() - started >= 0.9
+        assert result[0] == 'Completed, status code 200'
+        assert len(result[4]) > 0
+
     def test_try_get_request_connection_error(self):
         result = api.try_get_request('https://missing_location')
         assert result[0] == False
@@ -31,6 +60,17 @@ class TestApi(unittest.TestCase):
         assert result[1] == 'Failed, invalid URL'
         assert result[2] is None
 
+    def test_create_session(self):
+        session = api.create_session(pool_hosts=2, pool_size=8)
+        adapter = session.get_adapter('https://www.productreview.com.au')
+        assert adapter._pool_maxsize == 8
+        assert session.headers['Connection'] == 'keep-alive'
+        assert 'gzip' in session.headers['Accept-Encoding']
+
+    def test_connection_stats(self):
+        result = api.connection_stats(api.create_session())
+        assert result == {'requests': 0, 'connections_opened': 0, 'connections_reused': 0}
+
     def test_get_rating_distribution_ok_1(self):
         with open('./testdata/reviews_present_1.html', mode='r', encoding='utf8') as f:
             content = f.read()
@@ -55,6 +95,22 @@ class TestApi(unittest.TestCase):
         result = api.get_rating_distribution(soup)
         assert result == expected
 
+    def test_extract_scripts_matches_soup(self):
+        for name in ['reviews_present_1.html', 'reviews_present_2.html', 'reviews_absent.html', 'challenge_page.html']:
+            with open('./testdata/%s' % name, mode='r', encoding='utf8') as f:
+                html = f.read()
+            soup = BeautifulSoup(html, 'html.parser')
+            content_element = soup.find(name='script', attrs={'data-react-helmet': 'true'})
+            ssr_child = soup.find(string=re.compile(r'^window.__ssr_data'))
+            expected = (content_element.text if content_element is not None else None, str(ssr_child) if ssr_child is not None else None)
+            assert api.extract_scripts(html, True) == expected
+            assert api.extract_scripts(html, False)[0] == expected[0]
+
+    def test_extract_scripts_fallback(self):
+        html = "<html><head><script data-react-helmet='true' type='application/ld+json'>{}</script></head></html>"
+        assert api.HELMET_SCRIPT_RE.search(html) is None
+        assert api.extract_scripts(html, False) == ('{}', None)
+
     def test_parse_html_1(self):
         with open('./testdata/reviews_present_1.html', mode='r', encoding='utf8') as f:
             html = f.read()
@@ -144,6 +200,84 @@ class TestApi(unittest.TestCase):
         assert result[3] == []
         assert result[4] == {}
 
+    def test_get_reviews_from_page_cached(self):
+        with open('./testdata/reviews_present_2.html', mode='r', encoding='utf8') as f:
+            html = f.read()
+        url = 'https://www.productreview.com.au/listings/cached-listing'
+        response = requests.Response()
+        response.status_code, response._content, response.encoding = 200, html.encode('utf8'), 'utf8'
+        response.headers['ETag'] = '"v1"'
+        not_modified = requests.Response()
+        not_modified.status_code = 304
+        cache = api.PageCache(size=1, ttl=60)
+        with patch('api.PAGE_CACHE', cache), patch('api.try_get_request', return_value=(True, 'Completed, status code 200', response)) as patched_get:
+            expected = api.get_reviews_from_page(url, False, get_ssr_data=True)
+            expected[4].clear()
+            result = api.get_reviews_from_page(url, False, get_ssr_data=True)
+            assert patched_get.call_count == 1
+            assert result[3] == [0, 0, 0, 12, 152]
+            assert len(result[4]) == 25
+            assert api.get_reviews_from_page(url, False)[3] == []
+            cache.ttl = 0
+            patched_get.return_value = (True, 'Completed, status code 304', not_modified)
+            assert api.get_reviews_from_page(url, False, get_ssr_data=True) == result
+            assert patched_get.call_args[0][2] == {'If-None-Match': '"v1"'}
+        assert cache.stats() == {'pages': 1, 'hits': 2, 'revalidations': 1, 'misses': 1}
+        # fresh pages are served without waiting for the host's rate limiter
+        cache.ttl = 60
+        limiter = api.TokenBucket(rate=100, burst=1)
+        limiter.backoff(3)
+        with patch('api.PAGE_CACHE', cache), patch.dict(api.HOST_LIMITERS, {'www.productreview.com.au': limiter}), patch('api.try_get_request') as patched_get:
+            started = time.monotonic()
+            assert api.get_reviews_from_page(url, False, get_ssr_data=True) == result
+            assert time.monotonic() - started < 1
+            assert patched_get.call_count == 0
+
+    def test_parse_pool(self):
+        with open('./testdata/reviews_present_1.html', mode='rb') as f:
+            body = f.read()
+        response = requests.Response()
+        response.status_code, response._content, response.encoding = 200, body, 'utf8'
+        pool = api.create_parse_pool(2)
+        try:
+            with patch('api.PAGE_CACHE', api.PageCache(size=0)), patch('api.try_get_request', return_value=(True, 'Completed, status code 200', response)):
+                expected = api.get_reviews_from_page('test_url', False, get_ssr_data=True)
+                scans = api.STAGE_SECONDS.values[('scan',)]['count']
+                with patch('api.PARSE_POOL', pool):
+                    result = api.get_reviews_from_page('test_url', False, get_ssr_data=True)
+        finally:
+            pool.shutdown()
+        assert len(result[4]) > 0
+        assert result == expected
+        # stages timed in the worker process are reported by the parent
+        assert api.STAGE_SECONDS.values[('scan',)]['count'] == scans + 1
+
+    def test_parse_pool_broken(self):
+        with open('./testdata/reviews_present_1.html', mode='rb') as f:
+            body = f.read()
+        response = requests.Response()
+        response.status_code, response._content, response.encoding = 200, body, 'utf8'
+        pool = api.create_parse_pool(1)
+        for process in list(pool._processes.values()):
+            process.kill()
+            process.join()
+        with patch('api.PAGE_CACHE', api.PageCache(size=0)), patch('api.try_get_request', return_value=(True, 'Completed, status code 200', response)):
+            expected = api.parse_body(body, 'utf8', True, 'test_url', 'Completed, status code 200')
+            with patch('api.PARSE_POOL', pool):
+                # page is parsed in this thread and the pool is not used anymore
+                assert api.get_reviews_from_page('test_url', False, get_ssr_data=True) == expected
+                assert api.PARSE_POOL is None
+
+    def test_page_cache_eviction(self):
+        cache = api.PageCache(size=2)
+        response = requests.Response()
+        for url in ['a', 'b', 'c']:
+            cache.put(url, False, response, ('', '', 0, [], {}))
+            if url == 'b':
+                cache.get('a', False)
+        assert list(cache.entries.keys()) == ['a', 'c']
+        assert cache.get('a', True) is None
+
     def test_page_url(self):
         base_url = 'https://some.url.com'
         assert api.page_url(base_url, 4, 1, False) == '%s?rating=4' % (base_url)
@@ -196,11 +330,526 @@ class TestApi(unittest.TestCase):
             assert 'rating' in result['data'][k]
             assert 'date' in result['data'][k]
 
+    def test_get_reviews_concurrent_crawl(self):
+        url = 'https://www.productreview.com.au/listings/some-listing'
+        def fake_get_reviews_from_page(page, retry_on_rate_limit, get_ssr_data=False, throttle=True, budget=None):
+            if get_ssr_data:
+                return 'Completed, status code 200', 'Page %s' % page, 60, [0, 0, 0, 10, 50], {'first': {}}
+            return 'Completed, status code 200', 'Page %s' % page, 60, [], {page: {}}
+        streamed = []
+        with patch('api.get_reviews_from_page', side_effect=fake_get_reviews_from_page) as patched_get:
+            progress = []
+            result = api.get_reviews(url, crawl=True, page_limit=2, concurrency=4, on_reviews=streamed.append, on_progress=progress.append)
+            assert patched_get.call_count == 4
+        assert len(streamed) == 4
+        assert sorted(k for page in streamed for k in page) == sorted(result['data'].keys())
+        assert result['http_response'] == 'Completed, status code 200'
+        assert result['job_status'].startswith('Page %s?rating=' % url)
+        assert set(result['data'].keys()) == {'first', '%s?rating=4' % url, '%s?rating=5' % url, '%s?rating=5&page=2' % url}
+        assert progress[0] == {'pages_planned': 1, 'pages_done': 1, 'reviews': 1, 'star_rating': None, 'rate_limit_wait': 0}
+        assert progress[-1]['pages_planned'] == 4 and progress[-1]['pages_done'] == 4 and progress[-1]['reviews'] == 4
+
+    def test_get_reviews_without_rating_distribution(self):
+        url = 'https://www.productreview.com.au/listings/some-listing'
+        counts = {4: 10, 5: 50}
+        def fake_get_reviews_from_page(page, retry_on_rate_limit, get_ssr_data=False, throttle=True, budget=None):
+            if get_ssr_data:
+                return 'Completed, status code 200', 'Page %s' % page, 60, [], {'first': {'rating': 5}}
+            star_rating = int(re.search(r'rating=(\d)', page).group(1))
+            page_number = int(re.search(r'page=(\d+)', page).group(1)) if 'page=' in page else 1
+            count = max(0, min(25, counts.get(star_rating, 0) - 25 * (page_number - 1)))
+            return 'Completed, status code 200', 'Page %s' % page, 60, [], {'%s-%d' % (page, i): {'rating': star_rating} for i in range(count)}
+        progress = []
+        with patch('api.get_reviews_from_page', side_effect=fake_get_reviews_from_page) as patched_get:
+            result = api.get_reviews(url, crawl=True, concurrency=4, on_progress=progress.append)
+            assert patched_get.call_count == 8
+        assert len(result['data']) == 61
+        assert result['job_status'].endswith('pages planned: 8, requested: 8')
+        assert progress[-1]['pages_planned'] == 8 and progress[-1]['pages_done'] == 8
+        plan = api.CrawlPlan(url, 60, [1, 0, 0, 10, 50], {'first': {'rating': 1}}, window=4)
+        assert plan.initial_urls() == ['%s?rating=4' % url, '%s?rating=5' % url, '%s?rating=5&page=2' % url]
+        assert plan.follow('%s?rating=5' % url, ('Completed, status code 200', '', 60, [], {'first': {}})) == []
+        assert plan.follow('%s?rating=5&page=2' % url, ('Completed, status code 200', '', 60, [], {'first': {}})) == []
+        assert plan.last_page[5] == 0
+        # pages of a rating cut short are dropped from the plan
+        plan = api.CrawlPlan(url, 130, [0, 0, 0, 10, 120], {'first': {'rating': 5}})
+        assert plan.initial_urls() == ['%s?rating=4' % url, '%s?rating=5' % url]
+        assert plan.planned == 6
+        assert plan.follow('%s?rating=5' % url, ('Completed, status code 200', '', 130, [], {'first': {}})) == ['%s?rating=5&page=2' % url]
+        assert plan.follow('%s?rating=5&page=2' % url, ('Completed, status code 200', '', 130, [], {'first': {}})) == []
+        assert plan.planned == 3
+
+    def test_get_reviews_page_raises(self):
+        url = 'https://www.productreview.com.au/listings/some-listing'
+        def fake_get_reviews_from_page(page, retry_on_rate_limit, get_ssr_data=False, throttle=True, budget=None):
+            if get_ssr_data:
+                return 'Completed, status code 200', 'Page %s' % page, 200, [0, 0, 0, 0, 200], {'first': {'rating': 5}}
+            if page == '%s?rating=5&page=2' % url:
+                raise ValueError('unexpected page')
+            return 'Completed, status code 200', 'Page %s' % page, 200, [], {'%s-%d' % (page, i): {'rating': 5} for i in range(25)}
+        with patch('api.get_reviews_from_page', side_effect=fake_get_reviews_from_page) as patched_get:
+            result = api.get_reviews(url, crawl=True)
+            # paging goes on past the page that raised
+            assert patched_get.call_count == 9
+        assert len(result['data']) == 176
+        assert result['job_status'].endswith('pages planned: 9, requested: 9')
+
+    def test_get_reviews_incremental(self):
+        url = 'https://www.productreview.com.au/listings/some-listing'
+        listing = {'reviews': ['r%02d' % i for i in range(1, 61)], 'titles': {}, 'rating_distribution': [0, 0, 0, 0, 60]}
+        requested = []
+        def fake_get_reviews_from_page(page, retry_on_rate_limit, get_ssr_data=False, throttle=True, budget=None):
+            requested.append(page)
+            page_number = int(page.split('page=')[1]) if 'page=' in page else 1
+            got = {k: {'title': listing['titles'].get(k, k), 'date': k} for k in listing['reviews'][(page_number-1)*25:page_number*25]}
+            return 'Completed, status code 200', 'Page %s' % page, len(listing['reviews']), listing['rating_distribution'] if get_ssr_data else [], got
+        with patch('api.get_reviews_from_page', side_effect=fake_get_reviews_from_page), patch('api.LISTINGS', {}):
+            result = api.get_reviews(url, incremental=True)
+            assert len(result['data']) == 60
+            assert len(requested) == 4
+            # one review added on top, one edited on page 2
+            listing['reviews'].insert(0, 'r00')
+            listing['titles']['r30'] = 'edited'
+            listing['rating_distribution'] = [0, 0, 0, 0, 61]
+            requested.clear()
+            result = api.get_reviews(url, incremental=True)
+            assert sorted(result['data'].keys()) == ['r00', 'r30']
+            assert result['data']['r30']['title'] == 'edited'
+            assert requested == [url, '%s?rating=5' % url, '%s?rating=5&page=2' % url, '%s?rating=5&page=3' % url]
+            assert result['job_status'].endswith('new or changed since last crawl: 2')
+            # nothing changed
+            requested.clear()
+            result = api.get_reviews(url, incremental=True)
+            assert result['data'] == {}
+            assert requested == [url]
+            assert api.LISTINGS[url]['latest_date'] == 'r60'
+            assert api.LISTINGS[url]['rating_distribution'] == [0, 0, 0, 0, 61]
+
+    def test_get_reviews_incremental_failed_page(self):
+        url = 'https://www.productreview.com.au/listings/some-listing'
+        reviews = ['r%02d' % i for i in range(1, 61)]
+        requested, limited = [], []
+        def fake_get_reviews_from_page(page, retry_on_rate_limit, get_ssr_data=False, throttle=True, budget=None):
+            requested.append(page)
+            if page == '%s?rating=5&page=2' % url and not limited:
+                limited.append(page)
+                return 'Completed, status code 429', 'Failed to load page %s' % page, 0, [], {}
+            page_number = int(page.split('page=')[1]) if 'page=' in page else 1
+            got = {k: {'title': k, 'date': k} for k in reviews[(page_number-1)*25:page_number*25]}
+            return 'Completed, status code 200', 'Page %s' % page, len(reviews), [0, 0, 0, 0, 60] if get_ssr_data else [], got
+        with patch('api.get_reviews_from_page', side_effect=fake_get_reviews_from_page), patch('api.LISTINGS', {}):
+            result = api.get_reviews(url, incremental=True)
+            assert len(result['data']) == 25
+            assert requested == [url, '%s?rating=5' % url, '%s?rating=5&page=2' % url]
+            # rating 5 is not recorded as crawled, so the next run pages through it past the known first page
+            assert api.LISTINGS[url]['rating_distribution'] == [0, 0, 0, 0, None]
+            assert api.LISTINGS[url]['incomplete'] == [5]
+            requested.clear()
+            result = api.get_reviews(url, incremental=True)
+            assert sorted(result['data'].keys()) == reviews[25:]
+            assert requested == [url, '%s?rating=5' % url, '%s?rating=5&page=2' % url, '%s?rating=5&page=3' % url]
+            assert api.LISTINGS[url]['rating_distribution'] == [0, 0, 0, 0, 60]
+            assert api.LISTINGS[url]['incomplete'] == []
+
+    def test_fetch_pages_rate_limited(self):
+        attempts = []
+        def fake_get_reviews_from_page(page, retry_on_rate_limit, get_ssr_data=False, throttle=True, budget=None):
+            attempts.append(page)
+            if attempts.count(page) == 1:
+                return 'Completed, status code 429', 'Failed to load page %s' % page, 0, [], {}
+            return 'Completed, status code 200', 'Page %s' % page, 1, [], {page: {}}
+        urls = ['https://rate.limited/1', 'https://rate.limited/2']
+        api.HOST_LIMITERS['rate.limited'] = api.TokenBucket(rate=100, burst=10)
+        with patch('api.get_reviews_from_page', side_effect=fake_get_reviews_from_page):
+            result = dict(api.fetch_pages(urls, retry_on_rate_limit=True, concurrency=2))
+        assert len(attempts) == 4
+        assert set(result.keys()) == set(urls)
+        assert all(result[url][0] == 'Completed, status code 200' for url in urls)
+        with patch('api.get_reviews_from_page', side_effect=fake_get_reviews_from_page):
+            result = dict(api.fetch_pages(['https://rate.limited/3'], retry_on_rate_limit=False))
+        assert result['https://rate.limited/3'][0] == 'Completed, status code 429'
+
+    def test_token_bucket(self):
+        bucket = api.TokenBucket(rate=10, burst=2)
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        assert 0.05 < bucket.reserve() <= 0.1
+        bucket.backoff(5)
+        assert bucket.rate == 5
+        assert 4.9 < bucket.reserve() <= 5.1
+        bucket.recover()
+        assert bucket.rate == 5.5
+
+    def test_parse_retry_after(self):
+        assert api.parse_retry_after('7') == 7
+        assert api.parse_retry_after(None) == api.DEFAULT_RETRY_AFTER
+        assert api.parse_retry_after('soon') == api.DEFAULT_RETRY_AFTER
+        assert api.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+
     def test_run_job(self):
         def test_method(parameter1, parameter2):
-            return parameter1, parameter2, parameter1 + parameter2
+            return {'http_response': 'N/A', 'job_status': 'Done', 'data': {'sum': parameter1 + parameter2}}
         api.run_job('1', test_method, 1, 2)
-        assert api.JOBS['1'] == (1, 2, 3)
+        assert api.JOBS['1'] == {'http_response': 'N/A', 'job_status': 'Done', 'data': {'sum': 3}}
+
+    def test_sqlite_job_store(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'jobs.sqlite3')
+            jobs = store.SqliteJobStore(path, max_jobs=2)
+            jobs['a'] = {'http_response': 'N/A', 'job_status': 'In progress', 'data': {}}
+            jobs['a'] = {'http_response': 'N/A', 'job_status': 'Done', 'data': {'x': {'rating': 5}}}
+            jobs['b'] = {'data': {}}
+            assert 'a' in jobs
+            assert jobs.keys() == ['a', 'b']
+            # another process opening the same file sees the same jobs
+            assert store.SqliteJobStore(path)['a'] == {'http_response': 'N/A', 'job_status': 'Done', 'data': {'x': {'rating': 5}}}
+            jobs['c'] = {'data': {}}
+            assert jobs.keys() == ['b', 'c']
+            assert jobs.iter_reviews('a') == []
+            jobs.append_reviews('c', {'x': {'rating': 1}, 'y': {'rating': 2}})
+            jobs.append_reviews('c', {'x': {'rating': 3}})
+            rows = jobs.iter_reviews('c')
+            assert [(url, review) for _, url, review in rows] == [('x', {'rating': 3}), ('y', {'rating': 2})]
+            assert jobs.iter_reviews('c', after=rows[0][0], limit=5) == rows[1:]
+            jobs['c'] = {'http_response': 'N/A', 'data': {'y': {'rating': 2}, 'z': {'rating': 5}}}
+            assert jobs['c'] == {'http_response': 'N/A', 'data': {'y': {'rating': 2}, 'z': {'rating': 5}}}
+            assert jobs.header('c') == {'http_response': 'N/A', 'data': {}}
+            jobs.update_header('c', {'progress': {'pages_done': 2}})
+            assert jobs['c'] == {'http_response': 'N/A', 'progress': {'pages_done': 2}, 'data': {'y': {'rating': 2}, 'z': {'rating': 5}}}
+            del jobs['b']
+            assert 'b' not in jobs
+            with self.assertRaises(KeyError):
+                jobs['b']
+            expiring = store.SqliteJobStore(path, ttl=-1)
+            assert expiring.keys() == []
+            assert 'c' not in expiring
+            # expired jobs are evicted with their reviews on next write
+            expiring['d'] = {'data': {}}
+            assert jobs.iter_reviews('c') == []
+            assert jobs.connection().execute('SELECT COUNT(*) FROM review_bodies').fetchone()[0] == 0
+
+    def test_sqlite_job_store_shared_reviews(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            jobs = store.SqliteJobStore(os.path.join(tmp, 'jobs.sqlite3'))
+            jobs.append_reviews('a', {'x': {'rating': 5}})
+            jobs.append_reviews('b', {'x': {'rating': 5}})
+            assert jobs.iter_reviews('a')[0][1:] == ('x', {'rating': 5})
+            jobs['c'] = {'data': {'x': {'rating': 5}, 'y': {'rating': 1}}}
+            bodies = lambda: jobs.connection().execute('SELECT url, body FROM review_bodies ORDER BY url').fetchall()
+            assert [url for url, _ in bodies()] == ['x', 'y']
+            # a review edited in one job gets its own copy, the shared one stays for other jobs
+            jobs.append_reviews('c', {'x': {'rating': 4}})
+            assert [url for url, _ in bodies()] == ['x', 'x', 'y']
+            assert [review for _, _, review in jobs.iter_reviews('c')] == [{'rating': 4}, {'rating': 1}]
+            assert jobs.iter_reviews('b')[0][2] == {'rating': 5}
+            # copies go with the last job referring to them
+            jobs.append_reviews('a', {'x': {'rating': 4}})
+            jobs.append_reviews('b', {'x': {'rating': 4}})
+            assert [url for url, _ in bodies()] == ['x', 'y']
+            del jobs['c']
+            assert [url for url, _ in bodies()] == ['x']
+
+    def test_sqlite_listing_store(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            listings = store.SqliteListingStore(os.path.join(tmp, 'jobs.sqlite3'))
+            assert listings.get('https://some.url.com') is None
+            listings['https://some.url.com'] = {'reviews': {'a': '0123'}, 'latest_date': None, 'rating_distribution': [1, 0, 0, 0, 0]}
+            assert 'https://some.url.com' in listings
+            assert listings['https://some.url.com']['reviews'] == {'a': '0123'}
+
+    def test_memory_job_store(self):
+        jobs = store.MemoryJobStore(max_jobs=2)
+        jobs['a'] = {'data': {}}
+        jobs['b'] = {'data': {}}
+        jobs['a'] = {'data': {'x': 1}}
+        jobs['c'] = {'data': {}}
+        assert jobs.keys() == ['a', 'c']
+        assert jobs['a'] == {'data': {'x': 1}}
+        assert 'b' not in jobs
+
+    def test_review_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'jobs.sqlite3')
+            for index in (store.MemoryReviewIndex(), store.SqliteReviewIndex(path)):
+                index.record('a', {'x': {'rating': 5}, 'y': {'rating': 4}})
+                index.record('b', {'x': {'rating': 5}, 'y': {'rating': 3}, 'z': {'rating': 1}})
+                assert index.latest() == 4
+                found = index.lookup(['x', 'y', 'z', 'missing'])
+                assert {url: entry[1:] for url, entry in found.items()} == {'x': (1, 'a'), 'y': (3, 'b'), 'z': (4, 'b')}
+                assert found['y'][0] == store.review_digest({'rating': 3})
+            # shared by processes opening the same file
+            assert store.SqliteReviewIndex(path).latest() == 4
+            # reviews first seen longest ago are dropped beyond max_reviews
+            for index in (store.MemoryReviewIndex(max_reviews=2), store.SqliteReviewIndex(os.path.join(tmp, 'bounded.sqlite3'), max_reviews=2)):
+                index.record('a', {'x': {'rating': 5}, 'y': {'rating': 4}})
+                index.record('b', {'x': {'rating': 3}, 'z': {'rating': 1}})
+                assert sorted(index.lookup(['x', 'y', 'z'])) == ['x', 'z']
+                assert index.latest() == 4
+
+    def test_result_changed_reviews(self):
+        jobs = store.MemoryJobStore()
+        client = api.app.test_client()
+        with patch('api.JOBS', jobs), patch('api.REVIEWS', store.MemoryReviewIndex()):
+            jobs['a'] = {'http_response': 'Completed, status code 200', 'job_status': 'Done', 'data': {'x': {'rating': 5}, 'y': {'rating': 4}}}
+            api.REVIEWS.record('a', jobs['a']['data'])
+            jobs['b'] = {'http_response': 'Completed, status code 200', 'job_status': 'Done', 'data': {'x': {'rating': 5}, 'y': {'rating': 3}, 'z': {'rating': 1}}}
+            api.REVIEWS.record('b', jobs['b']['data'])
+            response = client.get('/result?job_id=b&changed_only=true').get_json()
+            assert response['data'] == {'y': {'rating': 3}, 'z': {'rating': 1}}
+            assert response['revision'] == 4
+            assert client.get('/result?job_id=b&since=3').get_json()['data'] == {'z': {'rating': 1}}
+            assert client.get('/result?job_id=a&since=0').get_json()['data'] == {'x': {'rating': 5}}
+            assert client.get('/result?job_id=b&changed_only=true&limit=2').get_json()['data'] == {'y': {'rating': 3}}
+
+    def test_memory_job_store_compact_reviews(self):
+        reviews = {
+            'https://www.productreview.com.au/reviews/4d0efe70-272a-5933-a2c3-d8a8794dad33': {'title': 'Home', 'content': 'Smooth', 'author_name': 'CLAC', 'author_uri': 'https://www.productreview.com.au/consumer-profiles/65f4f022-6a4e-5b3b-b6e5-7e3f3b3a0c38', 'rating': 5, 'date': '2022-04-08T05:13:20Z'},
+            'https://example.com/reviews/1': {'title': 'Other', 'content': '', 'author_name': 'A', 'author_uri': 'https://example.com/a', 'rating': 4, 'date': '2022-04-08'},
+        }
+        jobs = store.MemoryJobStore()
+        jobs['a'] = {'http_response': 'N/A', 'job_status': 'Done', 'data': json.loads(json.dumps(reviews))}
+        held = jobs.reviews['a'][bytes.fromhex('4d0efe70272a5933a2c3d8a8794dad33')][1]
+        assert isinstance(held, store.CompactReview)
+        assert held.author == bytes.fromhex('65f4f0226a4e5b3bb6e57e3f3b3a0c38')
+        assert held.date == 1649394800
+        assert jobs['a']['data'] == reviews
+        assert [url for _, url, _ in jobs.iter_reviews('a', limit=1)] == list(reviews)[:1]
+
+    def test_job_scheduler(self):
+        release = threading.Event()
+        def test_method(parameter):
+            release.wait(5)
+            return {'http_response': 'N/A', 'job_status': 'Done', 'data': {'p': parameter}}
+        scheduler = api.JobScheduler(workers=1, queue_size=1)
+        assert scheduler.submit('s1', test_method, 1) == True
+        for _ in range(100):
+            if scheduler.status()['running']:
+                break
+            time.sleep(0.01)
+        assert scheduler.submit('s2', test_method, 2) == True
+        assert scheduler.submit('s3', test_method, 3) == False
+        assert scheduler.status() == {'workers': 1, 'queued': 1, 'running': ['s1']}
+        release.set()
+        scheduler.queue.join()
+        assert api.JOBS['s2'] == {'http_response': 'N/A', 'job_status': 'Done', 'data': {'p': 2}}
+        assert scheduler.status() == {'workers': 1, 'queued': 0, 'running': []}
+
+    def test_scrape_post_returns_immediately(self):
+        release = threading.Event()
+        def fake_get_reviews(*args, **kwargs):
+            release.wait(5)
+            return {'http_response': 'Completed, status code 200', 'job_status': 'Done', 'data': {}}
+        with patch('api.get_reviews', side_effect=fake_get_reviews):
+            response = api.app.test_client().post('/', json={'url': 'https://www.productreview.com.au/listings/some-listing'})
+            assert response.status_code == 200
+            job_id = response.get_json()['fetch_results_at'].split('=')[1]
+            assert api.JOBS[job_id]['job_status'] in ('Requested', 'In progress')
+            release.set()
+            api.SCHEDULER.queue.join()
+        assert api.JOBS[job_id]['job_status'] == 'Done'
+
+    def test_result_pages(self):
+        jobs = store.MemoryJobStore()
+        client = api.app.test_client()
+        with patch('api.JOBS', jobs):
+            jobs['j'] = {'http_response': 'N/A', 'job_status': 'In progress', 'data': {}}
+            jobs.append_reviews('j', {'a': {'rating': 1}, 'b': {'rating': 2}, 'c': {'rating': 3}})
+            response = client.get('/result?job_id=j&limit=2').get_json()
+            assert response['data'] == {'a': {'rating': 1}, 'b': {'rating': 2}}
+            assert response['complete'] == False
+            response = client.get('/result?job_id=j&limit=2&cursor=%d' % response['next_cursor']).get_json()
+            assert response['data'] == {'c': {'rating': 3}}
+            assert response['complete'] == False
+            cursor = response['next_cursor']
+            assert client.get('/result?job_id=j&limit=2&cursor=%d' % cursor).get_json()['data'] == {}
+            jobs['j'] = {'http_response': 'Completed, status code 200', 'job_status': 'Done', 'data': {'a': {'rating': 1}, 'b': {'rating': 2}, 'c': {'rating': 3}, 'd': {'rating': 4}}}
+            response = client.get('/result?job_id=j&limit=2&cursor=%d' % cursor).get_json()
+            assert response['data'] == {'d': {'rating': 4}}
+            assert response['complete'] == True
+            assert len(client.get('/result?job_id=j').get_json()['data']) == 4
+
+    def test_progress_long_poll_and_events(self):
+        jobs = store.MemoryJobStore()
+        client = api.app.test_client()
+        with patch('api.JOBS', jobs):
+            jobs['j'] = {'http_response': 'N/A', 'job_status': 'In progress', 'data': {}}
+            state = client.get('/progress?job_id=j').get_json()
+            assert state['progress'] is None
+            threading.Timer(0.2, api.publish_progress, ('j', {'pages_planned': 3, 'pages_done': 1})).start()
+            started = time.monotonic()
+            response = client.get('/progress?job_id=j&version=%s' % state['version']).get_json()
+            assert time.monotonic() - started < 5
+            assert response['progress'] == {'pages_planned': 3, 'pages_done': 1}
+            assert client.get('/progress?job_id=j&version=%s&timeout=0.1' % response['version']).get_json() == response
+            jobs['j'] = {'http_response': 'Completed, status code 200', 'job_status': 'Done', 'data': {}}
+            events = client.get('/progress?job_id=j', headers={'Accept': 'text/event-stream'}).data.decode('utf8')
+            assert events.startswith('id: ') and '\nevent: done\ndata: ' in events
+            assert client.get('/progress?job_id=missing').status_code == 400
+
+    def test_result_cached_and_compressed(self):
+        jobs = store.MemoryJobStore()
+        client = api.app.test_client()
+        reviews = {'r%d' % i: {'title': 'Review %d' % i, 'rating': 5} for i in range(100)}
+        with patch('api.JOBS', jobs), patch('api.RESULT_CACHE', api.ResultCache()), patch('api.brotli', None), patch('api.dump_json', side_effect=api.dump_json) as patched_dump:
+            jobs['j'] = {'http_response': 'Completed, status code 200', 'job_status': 'Done', 'data': reviews}
+            response = client.get('/result?job_id=j')
+            assert response.get_json()['data'] == reviews
+            etag = response.headers['ETag']
+            assert client.get('/result?job_id=j', headers={'If-None-Match': etag}).status_code == 304
+            response = client.get('/result?job_id=j', headers={'Accept-Encoding': 'gzip'})
+            assert response.headers['Content-Encoding'] == 'gzip'
+            assert json.loads(gzip.decompress(response.data))['data'] == reviews
+            assert client.get('/result?job_id=j', headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']}).status_code == 304
+            assert patched_dump.call_count == 1
+            jobs['j'] = {'http_response': 'Completed, status code 200', 'job_status': 'Done again', 'data': reviews}
+            assert client.get('/result?job_id=j', headers={'If-None-Match': etag}).status_code == 200
+            assert patched_dump.call_count == 2
+
+    def test_result_ndjson_follows_running_job(self):
+        jobs = store.MemoryJobStore()
+        def finish():
+            time.sleep(0.2)
+            jobs.append_reviews('j', {'b': {'rating': 2}})
+            jobs['j'] = {'http_response': 'Completed, status code 200', 'job_status': 'Done', 'data': {'a': {'rating': 1}, 'b': {'rating': 2}}}
+        with patch('api.JOBS', jobs), patch('api.RESULT_STREAM_POLL_INTERVAL', 0.05):
+            jobs['j'] = {'http_response': 'N/A', 'job_status': 'In progress', 'data': {}}
+            jobs.append_reviews('j', {'a': {'rating': 1}})
+            threading.Thread(target=finish).start()
+            response = api.app.test_client().get('/result?job_id=j&format=ndjson')
+            lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert response.mimetype == 'application/x-ndjson'
+        assert lines[0] == {'http_response': 'N/A', 'job_status': 'In progress'}
+        assert [(line['url'], line['review']) for line in lines[1:-1]] == [('a', {'rating': 1}), ('b', {'rating': 2})]
+        assert lines[-1] == {'http_response': 'Completed, status code 200', 'job_status': 'Done', 'next_cursor': lines[-2]['cursor']}
+
+    def test_job_key(self):
+        options = api.parse_job_options({'crawl': 'true', 'page_limit': '2', 'concurrency': 8})
+        assert options == {'crawl': True, 'sort_by_oldest': False, 'retry_on_rate_limit': False, 'page_limit': 2, 'concurrency': 8, 'incremental': False}
+        key = api.job_key('https://www.productreview.com.au/listings/some-listing', options)
+        assert api.job_key('HTTPS://WWW.productreview.com.au/listings/some-listing/?rating=5#top', options) == key
+        assert api.job_key('https://www.productreview.com.au/listings/some-listing', dict(options, concurrency=1)) == key
+        assert api.job_key('https://www.productreview.com.au/listings/some-listing', dict(options, page_limit=3)) != key
+        options['crawl'] = False
+        assert api.job_key('https://www.productreview.com.au/listings/some-listing?rating=5', options) != api.job_key('https://www.productreview.com.au/listings/some-listing', options)
+
+    def test_batch_coalesces_jobs(self):
+        release = threading.Event()
+        calls = {}
+        def fake_get_reviews(url, **kwargs):
+            calls[url] = kwargs['budget']
+            release.wait(5)
+            return {'http_response': 'Completed, status code 200', 'job_status': 'Done', 'data': {}}
+        client = api.app.test_client()
+        urls = ['https://www.productreview.com.au/listings/listing-%d' % i for i in range(3)]
+        with patch('api.get_reviews', side_effect=fake_get_reviews):
+            response = client.post('/', json={'url': urls[0], 'crawl': 'true'}).get_json()
+            batch = client.post('/batch', json={'urls': urls + [urls[1] + '/'], 'crawl': 'true', 'concurrency': '3'}).get_json()
+            assert [job['coalesced'] for job in batch['jobs']] == [True, False, False, True]
+            assert batch['jobs'][0]['fetch_results_at'] == response['fetch_results_at']
+            assert batch['jobs'][1]['fetch_results_at'] == batch['jobs'][3]['fetch_results_at']
+            assert len(set(job['fetch_results_at'] for job in batch['jobs'])) == 3
+            release.set()
+            api.SCHEDULER.queue.join()
+        assert sorted(calls.keys()) == urls
+        assert calls[urls[0]] is None
+        assert calls[urls[1]] is calls[urls[2]] and calls[urls[1]] is not None
+        assert api.INFLIGHT == {}
+        assert client.post('/batch', json={'urls': ['https://some.url.com']}).status_code == 400
+
+    def test_bench_synthetic_listing(self):
+        listing = bench.SyntheticListing('synthetic', [3, 0, 0, 10, 40])
+        result = api.parse_html(listing.render(star_rating=5, page_number=2, padding=20000), True, 'test_url', 'Completed, status code 200')
+        assert result[1] == 'Page test_url: reviewCount=53; extracted from page: 15'
+        assert result[3] == [3, 0, 0, 10, 40]
+        assert all(review['rating'] == 5 for review in result[4].values())
+        server = bench.ListingServer([listing], padding=1000).start()
+        try:
+            bench.prepare_client(server)
+            result = api.get_reviews(server.listing_url('synthetic'), crawl=True, concurrency=4)
+        finally:
+            server.shutdown()
+            api.PAGE_CACHE = api.PageCache()
+        assert len(result['data']) == 53
+
+    @unittest.skipIf(api.aiohttp is None, 'aiohttp is not installed')
+    def test_async_crawl_engine(self):
+        listing = bench.SyntheticListing('synthetic', [3, 0, 0, 10, 40])
+        server = bench.ListingServer([listing], padding=1000).start()
+        engine = api.AsyncCrawlEngine()
+        try:
+            bench.prepare_client(server)
+            expected = api.get_reviews(server.listing_url('synthetic'), crawl=True, retry_on_rate_limit=True, concurrency=4)
+            with patch('api.ASYNC_ENGINE', engine):
+                result = api.get_reviews(server.listing_url('synthetic'), crawl=True, retry_on_rate_limit=True, concurrency=4)
+        finally:
+            engine.close()
+            server.shutdown()
+            api.PAGE_CACHE = api.PageCache()
+        assert len(result['data']) == 53
+        assert result['data'] == expected['data']
+
+    @unittest.skipIf(api.aiohttp is None, 'aiohttp is not installed')
+    def test_async_job_scheduler(self):
+        listing = bench.SyntheticListing('synthetic', [3, 0, 0, 10, 40])
+        server = bench.ListingServer([listing], padding=1000, latency=0.1).start()
+        engine = api.AsyncCrawlEngine()
+        scheduler = api.AsyncJobScheduler(engine, workers=8)
+        jobs = store.MemoryJobStore()
+        running = []
+        try:
+            bench.prepare_client(server)
+            with patch('api.ASYNC_ENGINE', engine), patch('api.SCHEDULER', scheduler), patch('api.JOBS', jobs), patch('api.REVIEWS', store.MemoryReviewIndex()):
+                options = {'crawl': True, 'sort_by_oldest': False, 'retry_on_rate_limit': True, 'incremental': False, 'concurrency': 2}
+                # distinct page limits keep the jobs from being coalesced
+                job_ids = [api.submit_job(server.listing_url('synthetic'), dict(options, page_limit=10+i))[0] for i in range(6)]
+                deadline = time.monotonic() + 20
+                while time.monotonic() < deadline and any(jobs.header(job_id)['job_status'] in api.PENDING_JOB_STATUSES for job_id in job_ids):
+                    running.append(len(scheduler.status()['running']))
+                    time.sleep(0.02)
+        finally:
+            engine.close()
+            server.shutdown()
+            api.PAGE_CACHE = api.PageCache()
+        # more listings are crawled at the same time than there are job worker threads
+        assert max(running) == 6 > api.JOB_WORKERS
+        assert scheduler.status() == {'workers': 8, 'queued': 0, 'running': []}
+        assert all(len(jobs[job_id]['data']) == 53 for job_id in job_ids)
+
+    def test_metrics_registry(self):
+        registry = metrics.Registry()
+        counter = registry.counter('requests_total', 'Requests', labels=('status',))
+        histogram = registry.histogram('stage_seconds', 'Stage time', labels=('stage',), buckets=(0.1, 1))
+        registry.gauge('queue_depth', 'Queue depth', callback=lambda: 3)
+        registry.counter('hits_total', 'Hits', callback=lambda: 7)
+        counter.inc(status='200')
+        counter.inc(2, status='200')
+        histogram.observe(0.05, stage='fetch')
+        histogram.observe(0.5, stage='fetch')
+        with self.assertRaises(ValueError):
+            counter.inc(code='200')
+        assert registry.render().splitlines() == [
+            '# HELP requests_total Requests', '# TYPE requests_total counter', 'requests_total{status="200"} 3',
+            '# HELP stage_seconds Stage time', '# TYPE stage_seconds histogram',
+            'stage_seconds_bucket{stage="fetch",le="0.1"} 1', 'stage_seconds_bucket{stage="fetch",le="1"} 2', 'stage_seconds_bucket{stage="fetch",le="+Inf"} 2',
+            'stage_seconds_sum{stage="fetch"} 0.55', 'stage_seconds_count{stage="fetch"} 2',
+            '# HELP queue_depth Queue depth', '# TYPE queue_depth gauge', 'queue_depth 3',
+            '# HELP hits_total Hits', '# TYPE hits_total counter', 'hits_total 7',
+        ]
+        with histogram.recording() as recorded:
+            histogram.observe(2, stage='fetch')
+        assert recorded == [({'stage': 'fetch'}, 2)]
+        assert histogram.values[('fetch',)]['count'] == 2
+
+    def test_metrics_endpoint(self):
+        with open('./testdata/reviews_present_1.html', mode='r', encoding='utf8') as f:
+            html = f.read()
+        api.parse_html(html, True, 'test_url', 'Completed, status code 200')
+        response = api.app.test_client().get('/metrics')
+        assert response.status_code == 200
+        body = response.get_data(as_text=True)
+        assert 'screview_stage_seconds_count{stage="scan"}' in body
+        assert 'screview_stage_seconds_count{stage="ssr_extract"}' in body
+        assert 'screview_job_queue_depth ' in body
 
 if __name__ == '__main__':
     unittest.main()